@@ -1,43 +1,553 @@
 import discord
 from discord import app_commands
 from discord.ext import tasks
+import abc
 import asyncio
+import bisect
+import functools
 import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
 import os
 import re
+import hashlib
+import heapq
+import contextlib
 import io
+import ipaddress
+import itertools
+import sqlite3
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import aiohttp
+from aiohttp import web
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from mcstatus import JavaServer  # Updated import for mcstatus
 import yt_dlp
-from collections import deque
+import dns.asyncresolver
+import dns.exception
+from collections import OrderedDict, deque
+from typing import Literal
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de mode cluster
+    fcntl = None
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True  # Enable members intent for on_member_join event
-bot = discord.Client(intents=intents)
-tree = app_commands.CommandTree(bot)
+
+# ----------- Sharding / cluster -----------
+# SHARD_COUNT=0 (défaut) : un seul discord.Client. Sinon AutoShardedClient ;
+# SHARD_IDS (ex. "0-3" ou "0,2,5") limite le processus à ces shards.
+# CLUSTER_PROCESSES>1 : ce processus ne se connecte pas, il lance un worker
+# par tranche de shards (voir launch_cluster). Chaque worker ne voit que les
+# événements de ses serveurs : son état en mémoire (files musicales, messages
+# de statut, giveaways...) ne contient que ceux-là, et la config, les giveaways
+# et les sanctions rechargés au démarrage sont filtrés avec owns_guild().
+
+def parse_shard_ids(spec):
+    if not spec:
+        return None
+    ids = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        ids.update(range(int(first), int(last or first) + 1))
+    return ids
+
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))
+SHARD_IDS = parse_shard_ids(os.environ.get("SHARD_IDS"))   # None = tous les shards
+CLUSTER_PROCESSES = int(os.environ.get("CLUSTER_PROCESSES", "1"))
+CLUSTER_IDENTIFY_DELAY = 5.0  # secondes par shard entre deux lancements (limite d'IDENTIFY)
+# Worker d'un cluster : ne gère qu'une partie des serveurs
+CLUSTER_WORKER = bool(SHARD_COUNT) and SHARD_IDS is not None
+CLUSTER_NAME = f"shards-{min(SHARD_IDS)}-{max(SHARD_IDS)}" if CLUSTER_WORKER else None
+
+def shard_of(guild_id, shard_count=None):
+    # Formule de Discord : (guild_id >> 22) % shard_count
+    return (int(guild_id) >> 22) % (shard_count or SHARD_COUNT)
+
+def owns_guild(guild_id):
+    return not CLUSTER_WORKER or shard_of(guild_id) in SHARD_IDS
+
+# ----------- Métriques -----------
+# Chaque commande, événement et boucle tasks est chronométré (histogramme,
+# erreurs, exécutions en cours). Les jauges (files, FFmpeg...) ne sont
+# calculées qu'à la lecture. Le tout est servi au format texte Prometheus sur
+# http://METRICS_HOST:METRICS_PORT/metrics (METRICS_PORT=0 pour désactiver ;
+# en mode cluster, port + premier shard du worker).
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOOP_LAG_INTERVAL = 1.0  # secondes entre deux mesures du retard de la boucle
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.total}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+class Metrics:
+    def __init__(self):
+        self.latency = {}    # (kind, name) -> Histogram
+        self.errors = {}     # (kind, name) -> nombre d'exceptions
+        self.in_flight = {}  # (kind, name) -> exécutions en cours
+        self.gauges = {}     # nom -> fonction appelée à chaque lecture
+        self.counters = {}   # nom -> valeur
+        self.loop_lag = Histogram()
+
+    def timed(self, kind, name):
+        # Décorateur de coroutine : deux perf_counter() et quelques accès dict par appel
+        key = (kind, name)
+        histogram = self.latency.setdefault(key, Histogram())
+        self.errors.setdefault(key, 0)
+        self.in_flight.setdefault(key, 0)
+        errors, in_flight = self.errors, self.in_flight
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                in_flight[key] += 1
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    errors[key] += 1
+                    raise
+                finally:
+                    in_flight[key] -= 1
+                    histogram.observe(time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def render(self):
+        lines = ["# TYPE bot_handler_duration_seconds histogram"]
+        for (kind, name), histogram in self.latency.items():
+            lines += histogram.render("bot_handler_duration_seconds", f'kind="{kind}",name="{name}"')
+        lines.append("# TYPE bot_handler_errors_total counter")
+        lines += [f'bot_handler_errors_total{{kind="{kind}",name="{name}"}} {count}' for (kind, name), count in self.errors.items()]
+        lines.append("# TYPE bot_handler_in_flight gauge")
+        lines += [f'bot_handler_in_flight{{kind="{kind}",name="{name}"}} {count}' for (kind, name), count in self.in_flight.items()]
+        lines.append("# TYPE bot_event_loop_lag_seconds histogram")
+        lines += self.loop_lag.render("bot_event_loop_lag_seconds", "")
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, fn in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class RateLimitCounter(logging.Handler):
+    # discord.py ne signale les 429 que dans ses logs : on les compte au passage
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith(("We are being rate limited", "Global rate limit")):
+            metrics.inc("bot_rest_rate_limited_total")
+
+logging.getLogger("discord.http").addHandler(RateLimitCounter(logging.WARNING))
+
+async def sample_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        metrics.loop_lag.observe(max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+async def serve_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return
+    port = METRICS_PORT + (min(SHARD_IDS) if CLUSTER_WORKER else 0)
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    spawn(sample_loop_lag(), "sample_loop_lag")
+    log.info("Metrics on http://%s:%s/metrics", METRICS_HOST, port)
+
+# ----------- Journalisation -----------
+# Lignes JSON écrites par un thread dédié : les handlers ne font que mettre
+# l'enregistrement dans une file (jamais d'écriture bloquante sur stdout ou
+# journald dans la boucle). Le message est mis en forme dans ce thread, à
+# partir d'arguments simples (ids, nombres, chaînes) passés en %s ou en extra.
+# Niveau par sous-système (LOG_LEVELS="bot.voice=DEBUG,discord=WARNING") et
+# débit limité pour les événements fréquents (arrivées en masse, vocal...).
+
+LOG_LEVELS = {"bot": "INFO", "discord": "INFO"}
+LOG_RATE_LIMITS = {"bot.members": 20, "bot.voice": 20, "bot.music": 50}  # messages/s sous WARNING
+LOG_QUEUE_SIZE = 10000  # au-delà, les messages sont abandonnés (et comptés)
+
+log = logging.getLogger("bot")
+cluster_log = logging.getLogger("bot.cluster")
+config_log = logging.getLogger("bot.config")
+members_log = logging.getLogger("bot.members")
+moderation_log = logging.getLogger("bot.moderation")
+music_log = logging.getLogger("bot.music")
+voice_log = logging.getLogger("bot.voice")
+status_log = logging.getLogger("bot.status")
+giveaway_log = logging.getLogger("bot.giveaways")
+warns_log = logging.getLogger("bot.warns")
+
+# Attributs présents sur tout LogRecord : le reste vient de extra=
+_LOG_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _LOG_RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    # Au-delà de `rate` messages par seconde (sous WARNING), les suivants sont
+    # écartés ; leur nombre est joint au prochain message gardé.
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._second = 0
+        self._count = 0
+        self._suppressed = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        second = int(record.created)
+        if second != self._second:
+            self._second = second
+            self._count = 0
+        self._count += 1
+        if self._count > self.rate:
+            self._suppressed += 1
+            metrics.inc("bot_log_suppressed_total")
+            return False
+        if self._suppressed:
+            record.suppressed = self._suppressed
+            self._suppressed = 0
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Mise en forme laissée au thread d'écriture
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("bot_log_dropped_total")
+
+log_listener = None
+
+def setup_logging():
+    global log_listener
+    levels = dict(LOG_LEVELS)
+    for item in filter(None, os.environ.get("LOG_LEVELS", "").split(",")):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    for name, rate in LOG_RATE_LIMITS.items():
+        logging.getLogger(name).addFilter(RateLimitFilter(rate))
+
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.addHandler(NonBlockingQueueHandler(records))
+    log_listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    log_listener.start()
+
+class MetricsClientMixin:
+    # @bot.event : chaque gestionnaire d'événement est chronométré
+    def event(self, coro):
+        return super().event(metrics.timed("event", coro.__name__)(coro))
+
+class MetricsCommandTree(app_commands.CommandTree):
+    # @tree.command : chaque commande slash est chronométrée
+    def command(self, *args, **kwargs):
+        register = super().command(*args, **kwargs)
+
+        def decorator(func):
+            return register(metrics.timed("command", kwargs.get("name") or func.__name__)(func))
+        return decorator
+
+class Bot(MetricsClientMixin, discord.AutoShardedClient if SHARD_COUNT else discord.Client):
+    pass
+
+if SHARD_COUNT:
+    bot = Bot(
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=sorted(SHARD_IDS) if SHARD_IDS is not None else None
+    )
+else:
+    bot = Bot(intents=intents)
+tree = MetricsCommandTree(bot)
+metrics.gauge("bot_guilds", lambda: len(bot.guilds))
+metrics.gauge("bot_gateway_latency_seconds", lambda: bot.latency)
 
 CONFIG_FILE = "config.json"
+CONFIG_FLUSH_DELAY = 2.0  # secondes avant l'écriture différée de config.json
 
-def load_config():
-    if os.path.isfile(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
+def load_config(path=CONFIG_FILE):
+    if os.path.isfile(path):
+        with open(path, "r") as f:
             return json.load(f)
     else:
         return {}
 
-def save_config(config):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=4)
-        # Ensure data is flushed to disk
-        f.flush()
-        os.fsync(f.fileno())
+# ----------- Stockage de la config -----------
+# Les commandes modifient `config` puis appellent config_store.mark_dirty(guild_id).
+# Les écritures sont regroupées et faites en tâche de fond : seuls les serveurs
+# modifiés sont re-sérialisés, et le fichier est écrit hors de la boucle
+# d'événements via un fichier temporaire + rename (écriture atomique).
+
+class ConfigStore:
+    def __init__(self, path=CONFIG_FILE, flush_delay=CONFIG_FLUSH_DELAY, owns=None):
+        self.path = path
+        self.flush_delay = flush_delay
+        # owns : en mode cluster, ne garder que les serveurs de ce processus
+        self.owns = owns
+        self.data = {guild_id: conf for guild_id, conf in load_config(path).items() if owns is None or owns(guild_id)}
+        # JSON déjà sérialisé de chaque serveur, réutilisé tant qu'il n'est pas modifié
+        self._fragments = {guild_id: self._serialize(conf) for guild_id, conf in self.data.items()}
+        self._dirty = set()
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _serialize(conf):
+        return json.dumps(conf, indent=4)
+
+    def mark_dirty(self, *guild_ids):
+        self._dirty.update(str(guild_id) for guild_id in guild_ids)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Pas de boucle (script, arrêt du bot) : écriture immédiate
+            self.flush_sync()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Boucle tant que des modifications arrivent pendant une écriture
+        while self._dirty:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    def _collect(self):
+        dirty, self._dirty = self._dirty, set()
+        for guild_id in dirty:
+            conf = self.data.get(guild_id)
+            if conf is None:
+                self._fragments.pop(guild_id, None)
+            else:
+                self._fragments[guild_id] = self._serialize(conf)
+        return dirty, dict(self._fragments)
+
+    def _write(self, fragments):
+        if self.owns is None:
+            self._write_file(fragments)
+            return
+        # Mode cluster : les autres workers écrivent le même fichier. Sous verrou,
+        # on relit leurs serveurs et on ne remplace que les nôtres.
+        if fcntl is None:
+            raise RuntimeError("le mode cluster nécessite fcntl (Linux/macOS)")
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            others = {
+                guild_id: self._serialize(conf)
+                for guild_id, conf in load_config(self.path).items()
+                if not self.owns(guild_id)
+            }
+            self._write_file({**others, **fragments})
+
+    def _write_file(self, fragments):
+        # Même rendu que json.dump(config, indent=4), assemblé à partir des fragments
+        body = ",\n".join(
+            f"    {json.dumps(guild_id)}: {fragment.replace(chr(10), chr(10) + '    ')}"
+            for guild_id, fragment in fragments.items()
+        )
+        text = "{\n" + body + "\n}" if body else "{}"
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            # Ensure data is flushed to disk
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, fragments = self._collect()
+            try:
+                await asyncio.to_thread(self._write, fragments)
+            except Exception as e:
+                self._dirty |= dirty
+                config_log.error("Failed to save config: %s", e)
+
+    def flush_sync(self):
+        if not self._dirty:
+            return
+        _, fragments = self._collect()
+        self._write(fragments)
+
+config_store = ConfigStore(owns=owns_guild if CLUSTER_WORKER else None)
+config = config_store.data
+
+class SQLiteStore:
+    # Base des stockages SQLite : une connexion utilisée depuis un seul thread
+    # dédié, pour que les requêtes ne bloquent jamais la boucle d'événements.
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{os.path.basename(path)}")
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def close(self):
+        if self._conn is not None:
+            self._executor.submit(self._conn.close).result()
+            self._conn = None
+        self._executor.shutdown()
+
+SCHEDULER_MAX_ATTEMPTS = 5     # essais avant d'abandonner une échéance en erreur
+SCHEDULER_MAX_BACKOFF = 3600   # délai maximum entre deux essais (secondes)
+
+class DeadlineScheduler(abc.ABC):
+    # Un seul timer pour un ensemble d'échéances : tas trié par date, on dort
+    # jusqu'à la plus proche. fire(key) est appelé pour chaque échéance atteinte.
+    def __init__(self):
+        self._heap = []  # (échéance, clé)
+        self._due = {}   # clé -> échéance actuelle (les entrées périmées du tas sont ignorées)
+        self._attempts = {}  # clé -> essais en erreur
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._firing = set()  # références des fire() en cours (sinon ramassables par le GC)
+
+    @property
+    def started(self):
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def schedule(self, key, due):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
+        if self._heap[0][1] == key:
+            self._wakeup.set()
+
+    def cancel(self, key):
+        self._due.pop(key, None)
+        self._attempts.pop(key, None)
+
+    def retry(self, key, error, delay):
+        # Réessai avec délai doublé à chaque échec. Erreur définitive (permissions
+        # manquantes, objet supprimé) ou trop d'essais : abandon, renvoie False.
+        attempts = self._attempts.get(key, 0) + 1
+        if isinstance(error, (discord.Forbidden, discord.NotFound)) or attempts >= SCHEDULER_MAX_ATTEMPTS:
+            self._attempts.pop(key, None)
+            return False
+        self._attempts[key] = attempts
+        self.schedule(key, time.time() + min(delay * 2 ** (attempts - 1), SCHEDULER_MAX_BACKOFF))
+        return True
+
+    def _fired(self, task):
+        self._firing.discard(task)
+        if not task.cancelled() and task.exception():
+            log.error("Scheduled job failed", exc_info=task.exception())
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                if self._due.get(key) != due:
+                    continue
+                del self._due[key]
+                task = asyncio.create_task(self.fire(key))
+                self._firing.add(task)
+                task.add_done_callback(self._fired)
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @abc.abstractmethod
+    async def fire(self, key):
+        ...
 
-config = load_config()
 status_messages = {}
 
 @bot.event
 async def on_member_join(member: discord.Member):
-    print(f"Member joined: {member.name} in guild {member.guild.name}")
+    members_log.info("Member joined", extra={"guild": member.guild.id, "member": member.id})
     guild_id = str(member.guild.id)
     guild_config = config.get(guild_id, {})
     auto_role_id = guild_config.get("auto_role_id")
@@ -46,9 +556,9 @@ async def on_member_join(member: discord.Member):
         if role:
             try:
                 await member.add_roles(role)
-                print(f"Auto role {role.name} assigned to {member.name} in guild {member.guild.name}")
+                members_log.info("Auto role assigned", extra={"guild": member.guild.id, "member": member.id, "role": role.id})
             except Exception as e:
-                print(f"Failed to assign auto role in guild {member.guild.name}: {e}")
+                members_log.warning("Failed to assign auto role: %s", e, extra={"guild": member.guild.id})
 
     join_channel_id = guild_config.get("join_announcement_channel_id")
     join_message = guild_config.get("join_announcement_message")
@@ -59,14 +569,90 @@ async def on_member_join(member: discord.Member):
                 embed = discord.Embed(title="Bienvenue !", description=join_message.replace("{member}", member.mention).replace("{name}", member.name), color=discord.Color.green())
                 await channel.send(embed=embed)
             except Exception as e:
-                print(f"Failed to send join announcement in guild {member.guild.name}: {e}")
+                members_log.warning("Failed to send join announcement: %s", e, extra={"guild": member.guild.id})
+
+# ----------- Démarrage -----------
+# setup_hook n'est appelé qu'une fois (après la connexion HTTP, avant la
+# passerelle) ; on_ready revient à chaque reconnexion et ne relance donc rien.
+# La synchronisation globale des commandes est lente et limitée par Discord :
+# elle n'est faite que si l'empreinte de l'arbre de commandes a changé.
+
+COMMAND_HASH_FILE = "command_tree.sha256"
+STARTUP_TIME = time.perf_counter()
+startup_stats = {"sync": None, "ready": None}
+
+def command_tree_hash():
+    payload = {
+        "application_id": bot.application_id,
+        "commands": sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: c["name"]),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-@bot.event
-async def on_ready():
+async def sync_commands():
+    # En mode cluster, seul le worker du shard 0 synchronise
+    if CLUSTER_WORKER and 0 not in SHARD_IDS:
+        return "skipped"
+    digest = command_tree_hash()
+    try:
+        with open(COMMAND_HASH_FILE) as f:
+            if f.read().strip() == digest:
+                return "unchanged"
+    except FileNotFoundError:
+        pass
     await tree.sync()
-    print(f"Connecté comme {bot.user}")
+    with open(COMMAND_HASH_FILE, "w") as f:
+        f.write(digest)
+    return "synced"
+
+background_tasks = set()  # tâches de fond lancées sans être attendues
+
+def spawn(coro, name):
+    # Garde une référence à la tâche (sinon ramassable par le GC) et journalise son échec
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+
+    def done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            log.critical("Background task %s failed", name, exc_info=task.exception())
+    task.add_done_callback(done)
+    return task
+
+async def start_background_jobs():
+    # Les planificateurs ont besoin du cache (salons, serveurs) : après le premier READY
+    await bot.wait_until_ready()
+    ticket_registry.prune(bot)
+    # Démarrés séparément : une base illisible ne doit pas bloquer l'autre
+    results = await asyncio.gather(giveaway_scheduler.start(), sanction_scheduler.start(), return_exceptions=True)
+    for name, result in zip(("giveaways", "sanctions"), results):
+        if isinstance(result, Exception):
+            log.critical("Failed to start %s scheduler", name, exc_info=result)
+
+@bot.event
+async def setup_hook():
+    started = time.perf_counter()
+    try:
+        result = await sync_commands()
+    except Exception as e:
+        result = f"failed ({e})"
+    startup_stats["sync"] = time.perf_counter() - started
+    log.info("Command sync: %s in %.2fs", result, startup_stats["sync"])
     update_status.start()
-    giveaway_loop.start()
+    spawn(start_background_jobs(), "start_background_jobs")
+    try:
+        await start_metrics_server()
+    except OSError as e:
+        log.warning("Metrics server disabled: %s", e)
+
+@bot.event
+async def on_ready():
+    if startup_stats["ready"] is None:
+        # Premier READY : les commandes sont utilisables à partir d'ici
+        startup_stats["ready"] = time.perf_counter() - STARTUP_TIME
+        log.info("Connecté comme %s (ready in %.2fs after start)", bot.user, startup_stats["ready"])
+    else:
+        log.info("Reconnecté comme %s", bot.user)
+        recount_voice_listeners()
 
 @tree.command(name="setautorole", description="Configurer le rôle automatique de bienvenue")
 @app_commands.describe(role="Rôle à attribuer automatiquement aux nouveaux membres")
@@ -76,7 +662,7 @@ async def setautorole(interaction: discord.Interaction, role: discord.Role):
     if guild_id not in config:
         config[guild_id] = {}
     config[guild_id]["auto_role_id"] = role.id
-    save_config(config)
+    config_store.mark_dirty(guild_id)
     await interaction.response.send_message(f"Rôle automatique de bienvenue configuré : {role.mention}", ephemeral=True)
 
 @tree.command(name="setjoinannouncement", description="Configurer le message d'annonce de bienvenue")
@@ -88,12 +674,12 @@ async def setjoinannouncement(interaction: discord.Interaction, channel: discord
         config[guild_id] = {}
     config[guild_id]["join_announcement_channel_id"] = channel.id
     config[guild_id]["join_announcement_message"] = message
-    save_config(config)
+    config_store.mark_dirty(guild_id)
     await interaction.response.send_message(f"Message d'annonce de bienvenue configuré dans {channel.mention}", ephemeral=True)
 
 @bot.event
 async def on_member_remove(member: discord.Member):
-    print(f"Member left: {member.name} in guild {member.guild.name}")
+    members_log.info("Member left", extra={"guild": member.guild.id, "member": member.id})
     guild_id = str(member.guild.id)
     guild_config = config.get(guild_id, {})
     leave_channel_id = guild_config.get("leave_announcement_channel_id")
@@ -105,7 +691,7 @@ async def on_member_remove(member: discord.Member):
                 embed = discord.Embed(title="Au revoir !", description=leave_message.replace("{member}", member.name), color=discord.Color.red())
                 await channel.send(embed=embed)
             except Exception as e:
-                print(f"Failed to send leave announcement in guild {member.guild.name}: {e}")
+                members_log.warning("Failed to send leave announcement: %s", e, extra={"guild": member.guild.id})
 
 @tree.command(name="setleaveannouncement", description="Configurer le message d'annonce de départ")
 @app_commands.describe(channel="Salon pour l'annonce", message="Message d'annonce (utilisez {member} pour le nom)")
@@ -116,7 +702,7 @@ async def setleaveannouncement(interaction: discord.Interaction, channel: discor
         config[guild_id] = {}
     config[guild_id]["leave_announcement_channel_id"] = channel.id
     config[guild_id]["leave_announcement_message"] = message
-    save_config(config)
+    config_store.mark_dirty(guild_id)
     await interaction.response.send_message(f"Message d'annonce de départ configuré dans {channel.mention}", ephemeral=True)
 
 # ----------- /config -----------
@@ -129,12 +715,16 @@ async def setleaveannouncement(interaction: discord.Interaction, channel: discor
 @app_commands.checks.has_permissions(administrator=True)
 async def config_command(interaction: discord.Interaction, ip: str, port: int = 25565, channel: discord.TextChannel = None):
     guild_id = str(interaction.guild.id)
-    config[guild_id] = {
+    # Mise à jour sans écraser le reste de la config du serveur (annonces, tickets...)
+    guild_config = config.setdefault(guild_id, {})
+    if guild_config.get("channel_id") != (channel.id if channel else None):
+        guild_config.pop("status_message_id", None)
+    guild_config.update({
         "ip": ip,
         "port": port,
         "channel_id": channel.id if channel else None
-    }
-    save_config(config)
+    })
+    config_store.mark_dirty(guild_id)
     await interaction.response.send_message(f"Config enregistrée : {ip}:{port}, salon {channel.mention if channel else 'non défini'}", ephemeral=True)
 
 @tree.command(name="kick", description="Expulser un membre")
@@ -157,61 +747,489 @@ async def ban(interaction: discord.Interaction, member: discord.Member, reason:
     except Exception as e:
         await interaction.response.send_message(f"Erreur lors du bannissement: {e}", ephemeral=True)
 
+async def send_response(interaction, content=None, **kwargs):
+    # Réponse ou followup selon que l'interaction a déjà été différée
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
+
+# ----------- Index des bannis -----------
+# Liste des bannis par serveur, chargée une seule fois puis tenue à jour par
+# les événements de ban/déban. Sert à l'autocomplétion et à la recherche par
+# nom de /unban ; un débannissement par ID ne fait qu'un seul appel API.
+
+def ban_label(user):
+    # Ancien format nom#1234 pour les comptes qui ont encore un discriminant
+    if user.discriminator and user.discriminator != "0":
+        return f"{user.name}#{user.discriminator}"
+    return user.name
+
+BAN_LOAD_RETRY_DELAY = 300  # secondes avant de retenter un chargement échoué depuis l'autocomplétion
+
+class BanIndex:
+    def __init__(self):
+        self._bans = {}     # guild_id -> {user_id: (nom, nom en minuscules)}
+        self._loading = {}  # guild_id -> (tâche de chargement, bannis déjà lus, débannis pendant le chargement)
+        self._failed = {}   # guild_id -> instant (monotonic) du dernier échec de chargement
+
+    def get(self, guild_id):
+        # Bannis connus, même partiellement pendant le chargement
+        if guild_id in self._bans:
+            return self._bans[guild_id]
+        loading = self._loading.get(guild_id)
+        return loading[1] if loading else {}
+
+    def label(self, guild_id, user_id, default=None):
+        entry = self.get(guild_id).get(user_id)
+        return entry[0] if entry else default
+
+    def start_loading(self, guild, retry=False):
+        # retry=False (autocomplétion) : un échec récent n'est pas retenté à chaque frappe
+        if guild.id in self._bans:
+            return None
+        loading = self._loading.get(guild.id)
+        if loading is None:
+            failed = self._failed.get(guild.id)
+            if not retry and failed is not None and time.monotonic() - failed < BAN_LOAD_RETRY_DELAY:
+                return None
+            bans = {}
+            removed = set()
+            task = asyncio.create_task(self._load(guild, bans, removed))
+            task.add_done_callback(lambda t, guild_id=guild.id: self._loaded(guild_id, t))
+            loading = self._loading[guild.id] = (task, bans, removed)
+        return loading[0]
+
+    def _loaded(self, guild_id, task):
+        # Chargement lancé par l'autocomplétion : personne n'attend la tâche, l'erreur est journalisée ici
+        if not task.cancelled() and task.exception():
+            self._failed[guild_id] = time.monotonic()
+            moderation_log.warning("Failed to load ban list: %s", task.exception(), extra={"guild": guild_id})
+
+    async def ensure_loaded(self, guild):
+        task = self.start_loading(guild, retry=True)
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def _load(self, guild, bans, removed):
+        try:
+            async for entry in guild.bans(limit=None):
+                # Un déban arrivé pendant le chargement ne doit pas être annulé par une page plus récente
+                if entry.user.id not in removed:
+                    bans.setdefault(entry.user.id, self._entry(entry.user))
+            self._bans[guild.id] = bans
+            self._failed.pop(guild.id, None)
+        finally:
+            self._loading.pop(guild.id, None)
+
+    @staticmethod
+    def _entry(user):
+        label = ban_label(user)
+        return label, label.lower()
+
+    def add(self, guild_id, user):
+        loading = self._loading.get(guild_id)
+        if loading:
+            loading[2].discard(user.id)
+        if guild_id in self._bans or loading:
+            self.get(guild_id)[user.id] = self._entry(user)
+
+    def remove(self, guild_id, user_id):
+        loading = self._loading.get(guild_id)
+        if loading:
+            loading[2].add(user_id)
+        self.get(guild_id).pop(user_id, None)
+
+    def search(self, guild_id, text, limit=25):
+        text = text.lower()
+        results = []
+        for user_id, (label, lowered) in self.get(guild_id).items():
+            if text in lowered or text == str(user_id):
+                results.append((user_id, label))
+                if len(results) >= limit:
+                    break
+        return results
+
+    def find(self, guild_id, text):
+        text = text.lower()
+        for user_id, (label, lowered) in self.get(guild_id).items():
+            if lowered == text:
+                return user_id
+        return None
+
+ban_index = BanIndex()
+
+@bot.event
+async def on_member_ban(guild, user):
+    ban_index.add(guild.id, user)
+
+@bot.event
+async def on_member_unban(guild, user):
+    ban_index.remove(guild.id, user.id)
+
+def parse_user_id(text):
+    match = re.fullmatch(r"\s*(?:<@!?)?(\d{15,20})>?\s*", text)
+    return int(match.group(1)) if match else None
+
 @tree.command(name="unban", description="Débannir un membre")
-@app_commands.describe(user="Nom complet du membre (ex: User#1234)")
+@app_commands.describe(user="ID ou nom de l'utilisateur banni")
+@app_commands.default_permissions(administrator=True)
 @app_commands.checks.has_permissions(administrator=True)
 async def unban(interaction: discord.Interaction, user: str):
-    banned_users = await interaction.guild.bans()
-    user_name, user_discriminator = user.split("#")
-    for ban_entry in banned_users:
-        if (ban_entry.user.name, ban_entry.user.discriminator) == (user_name, user_discriminator):
-            try:
-                await interaction.guild.unban(ban_entry.user)
-                await interaction.response.send_message(f"{user} a été débanni.")
-                return
-            except Exception as e:
-                await interaction.response.send_message(f"Erreur lors du débannissement: {e}", ephemeral=True)
-                return
-    await interaction.response.send_message(f"Utilisateur {user} non trouvé dans la liste des bannis.", ephemeral=True)
+    guild = interaction.guild
+    user_id = parse_user_id(user)
+    if user_id is None:
+        # Recherche par nom : la liste des bannis n'est téléchargée qu'une fois par serveur
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await ban_index.ensure_loaded(guild)
+        except Exception as e:
+            # Permission ban_members manquante, erreur HTTP...
+            await interaction.followup.send(f"Impossible de lire la liste des bannis : {e}", ephemeral=True)
+            return
+        user_id = ban_index.find(guild.id, user)
+        if user_id is None:
+            await interaction.followup.send(f"Utilisateur {user} non trouvé dans la liste des bannis.", ephemeral=True)
+            return
+    label = ban_index.label(guild.id, user_id, user)
+    try:
+        await guild.unban(discord.Object(id=user_id))
+        ban_index.remove(guild.id, user_id)
+        await send_response(interaction, f"{label} a été débanni.")
+    except discord.NotFound:
+        ban_index.remove(guild.id, user_id)
+        await send_response(interaction, f"Utilisateur {user} non trouvé dans la liste des bannis.", ephemeral=True)
+    except Exception as e:
+        await send_response(interaction, f"Erreur lors du débannissement: {e}", ephemeral=True)
+
+@unban.autocomplete("user")
+async def unban_autocomplete(interaction: discord.Interaction, current: str):
+    # Les checks de /unban ne s'appliquent pas à l'autocomplétion : la liste des bannis reste réservée aux admins
+    if not interaction.permissions.administrator:
+        return []
+    # Premier appel : chargement lancé en arrière-plan, résultats partiels en attendant
+    ban_index.start_loading(interaction.guild)
+    return [
+        app_commands.Choice(name=f"{label} ({user_id})"[:100], value=str(user_id))
+        for user_id, label in ban_index.search(interaction.guild.id, current)
+    ]
+
+# ----------- Purge -----------
+# Historique parcouru page par page (newest first) et supprimé au fil de l'eau :
+# messages de moins de 14 jours par lots de 100 (suppression groupée), plus
+# anciens un par un. La réponse est différée et la progression affichée.
+
+PURGE_MAX = 10000              # messages supprimés au maximum par commande
+PURGE_SCAN_LIMIT = 20000       # messages parcourus au maximum (avec filtres)
+PURGE_PROGRESS_INTERVAL = 3    # secondes entre deux mises à jour de la progression
+# Limite Discord de la suppression groupée (14 jours), avec une marge de 5 minutes
+BULK_DELETE_MAX_AGE = 14 * 86400 - 300
+
+async def purge_messages(channel, amount, check, after=None, progress=None):
+    bulk_limit = discord.utils.utcnow() - timedelta(seconds=BULK_DELETE_MAX_AGE)
+    deleted = 0
+    scanned = 0
+    batch = []
+    last_report = time.monotonic()
+
+    async def flush_batch():
+        nonlocal deleted
+        if batch:
+            await channel.delete_messages(batch)
+            deleted += len(batch)
+            batch.clear()
+
+    async for message in channel.history(limit=PURGE_SCAN_LIMIT, after=after, oldest_first=False):
+        scanned += 1
+        if check(message):
+            if message.created_at > bulk_limit:
+                batch.append(message)
+                if len(batch) == 100:
+                    await flush_batch()
+            else:
+                # Trop ancien pour la suppression groupée : un par un (limites gérées par discord.py)
+                await flush_batch()
+                try:
+                    await message.delete()
+                    deleted += 1
+                except discord.NotFound:
+                    pass
+            if deleted + len(batch) >= amount:
+                break
+        if progress and time.monotonic() - last_report >= PURGE_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress(deleted + len(batch), scanned)
+    await flush_batch()
+    return deleted, scanned
 
 @tree.command(name="purge", description="Supprimer un nombre de messages")
-@app_commands.describe(amount="Nombre de messages à supprimer (max 100)")
+@app_commands.describe(
+    amount=f"Nombre de messages à supprimer (max {PURGE_MAX})",
+    member="Seulement les messages de ce membre (optionnel)",
+    pattern="Seulement les messages correspondant à cette expression régulière (optionnel)",
+    minutes="Seulement les messages des N dernières minutes (optionnel)"
+)
 @app_commands.checks.has_permissions(administrator=True)
-async def purge(interaction: discord.Interaction, amount: int):
-    if amount < 1 or amount > 100:
-        await interaction.response.send_message("Le nombre doit être entre 1 et 100.", ephemeral=True)
+async def purge(interaction: discord.Interaction, amount: int, member: discord.User = None, pattern: str = None, minutes: int = None):
+    if amount < 1 or amount > PURGE_MAX:
+        await interaction.response.send_message(f"Le nombre doit être entre 1 et {PURGE_MAX}.", ephemeral=True)
+        return
+    try:
+        regex = re.compile(pattern) if pattern else None
+    except re.error as e:
+        await interaction.response.send_message(f"Expression régulière invalide : {e}", ephemeral=True)
         return
+    after = discord.utils.utcnow() - timedelta(minutes=minutes) if minutes else None
+
+    def check(message):
+        if member and message.author.id != member.id:
+            return False
+        if regex and not regex.search(message.content):
+            return False
+        return True
+
+    # Une longue purge dépasse le délai de 3 s d'une interaction : réponse différée
+    await interaction.response.defer(ephemeral=True)
+    progress_message = await interaction.followup.send("🧹 Suppression en cours…", ephemeral=True, wait=True)
+
+    async def progress(deleted, scanned):
+        try:
+            await progress_message.edit(content=f"🧹 {deleted} messages supprimés ({scanned} parcourus)…")
+        except Exception:
+            pass
+
     try:
-        deleted = await interaction.channel.purge(limit=amount)
-        await interaction.response.send_message(f"{len(deleted)} messages supprimés.", ephemeral=True)
+        deleted, _ = await purge_messages(interaction.channel, amount, check, after, progress)
     except Exception as e:
-        await interaction.response.send_message(f"Erreur lors de la suppression: {e}", ephemeral=True)
+        await interaction.followup.send(f"Erreur lors de la suppression: {e}", ephemeral=True)
+        return
+    try:
+        await progress_message.edit(content=f"{deleted} messages supprimés.")
+    except Exception:
+        # Jeton d'interaction expiré (purge de plus de 15 minutes)
+        await interaction.channel.send(f"{deleted} messages supprimés.", delete_after=10)
+
+# ----------- Sanctions temporaires -----------
+# Les sanctions à durée limitée sont enregistrées (serveur, membre, action,
+# expiration) et levées par un timer unique, y compris après un redémarrage.
+# Une sanction en attente ne coûte qu'une petite entrée, pas une coroutine.
+
+SANCTIONS_DB_FILE = "sanctions.db"
+SANCTION_RETRY_DELAY = 60  # secondes avant le premier réessai d'une levée en erreur (puis doublé)
+
+class SanctionStore(SQLiteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sanctions (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            channel_id INTEGER,
+            PRIMARY KEY (guild_id, user_id, action)
+        );
+    """
+
+    def __init__(self, path=SANCTIONS_DB_FILE):
+        super().__init__(path)
+
+    def _add(self, key, expires_at, channel_id):
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO sanctions (guild_id, user_id, action, expires_at, channel_id) VALUES (?, ?, ?, ?, ?)",
+                (*key, expires_at, channel_id),
+            )
+
+    def _remove(self, key):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM sanctions WHERE guild_id = ? AND user_id = ? AND action = ?", key)
+
+    def _load(self):
+        rows = self._db().execute("SELECT guild_id, user_id, action, expires_at, channel_id FROM sanctions").fetchall()
+        return {(guild_id, user_id, action): (expires_at, channel_id) for guild_id, user_id, action, expires_at, channel_id in rows}
+
+    async def add(self, key, expires_at, channel_id=None):
+        await self._call(self._add, key, expires_at, channel_id)
+
+    async def remove(self, key):
+        await self._call(self._remove, key)
+
+    async def load(self):
+        return await self._call(self._load)
+
+sanction_store = SanctionStore()
+
+class SanctionScheduler(DeadlineScheduler):
+    def __init__(self):
+        super().__init__()
+        self.channels = {}  # (guild_id, user_id, action) -> salon où annoncer la levée
+
+    async def start(self):
+        if self.started:
+            return
+        for key, (expires_at, channel_id) in (await sanction_store.load()).items():
+            if not owns_guild(key[0]):
+                continue
+            self.channels[key] = channel_id
+            self.schedule(key, expires_at)
+        await super().start()
+
+    async def add(self, guild_id, user_id, action, expires_at, channel_id=None):
+        key = (guild_id, user_id, action)
+        self.channels[key] = channel_id
+        await sanction_store.add(key, expires_at, channel_id)
+        self.schedule(key, expires_at)
+
+    async def remove(self, guild_id, user_id, action):
+        key = (guild_id, user_id, action)
+        self.cancel(key)
+        self.channels.pop(key, None)
+        await sanction_store.remove(key)
+
+    async def fire(self, key):
+        guild_id, user_id, action = key
+        try:
+            await SANCTION_HANDLERS[action](guild_id, user_id, self.channels.get(key))
+        except Exception as e:
+            if self.retry(key, e, SANCTION_RETRY_DELAY):
+                moderation_log.warning("Failed to lift %s, retrying: %s", action, e, extra={"guild": guild_id, "member": user_id})
+                return
+            moderation_log.error("Giving up lifting %s: %s", action, e, extra={"guild": guild_id, "member": user_id})
+        self.cancel(key)
+        self.channels.pop(key, None)
+        await sanction_store.remove(key)
+
+async def lift_mute(guild_id, user_id, channel_id):
+    guild = bot.get_guild(guild_id)
+    if not guild:
+        return
+    member = guild.get_member(user_id)
+    muted_role = discord.utils.get(guild.roles, name="Muted")
+    if not member or not muted_role or muted_role not in member.roles:
+        return
+    await member.remove_roles(muted_role, reason="Fin de la sourdine")
+    channel = guild.get_channel(channel_id) if channel_id else None
+    if channel:
+        await channel.send(f"{member.mention} n'est plus en sourdine.")
+
+# Action -> fonction qui lève la sanction (ex: un futur "ban" temporaire)
+SANCTION_HANDLERS = {
+    "mute": lift_mute,
+}
+
+sanction_scheduler = SanctionScheduler()
+
+# ----------- Sourdine -----------
+# Mode "timeout" : exclusion temporaire native de Discord, un seul appel API par
+# sourdine et aucune permission de salon à modifier (limité à 28 jours).
+# Mode "role" : rôle Muted, utilisé aussi pour les sourdines permanentes ou plus longues.
+
+MUTE_MODE = "timeout"                 # mode par défaut, modifiable par serveur avec /setmutemode
+MAX_TIMEOUT_MINUTES = 28 * 24 * 60    # durée max d'une exclusion temporaire Discord
+MUTE_OVERWRITE_CONCURRENCY = 5        # salons configurés en parallèle (les limites par route restent gérées par discord.py)
+MUTE_PROGRESS_INTERVAL = 2            # secondes entre deux messages de progression
+
+async def apply_muted_overwrites(muted_role, channels, progress=None):
+    semaphore = asyncio.Semaphore(MUTE_OVERWRITE_CONCURRENCY)
+    total = len(channels)
+    done = 0
+    failed = 0
+    last_report = time.monotonic()
+
+    async def apply(channel):
+        nonlocal done, failed, last_report
+        async with semaphore:
+            try:
+                await channel.set_permissions(muted_role, send_messages=False, add_reactions=False, speak=False, connect=False, reason="Configuration du rôle Muted")
+            except Exception as e:
+                failed += 1
+                moderation_log.warning("Failed to set Muted overwrite: %s", e, extra={"channel": channel.id})
+        done += 1
+        if progress and time.monotonic() - last_report >= MUTE_PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress(done, total)
+
+    await asyncio.gather(*(apply(channel) for channel in channels))
+    return failed
+
+@bot.event
+async def on_guild_channel_create(channel):
+    # Les salons créés après le rôle Muted sont couverts aussi
+    muted_role = discord.utils.get(channel.guild.roles, name="Muted")
+    if muted_role:
+        try:
+            await channel.set_permissions(muted_role, send_messages=False, add_reactions=False, speak=False, connect=False, reason="Configuration du rôle Muted")
+        except Exception as e:
+            moderation_log.warning("Failed to set Muted overwrite: %s", e, extra={"channel": channel.id})
+
+@tree.command(name="setmutemode", description="Choisir le mode de sourdine (exclusion temporaire ou rôle Muted)")
+@app_commands.describe(mode="timeout : exclusion temporaire Discord, role : rôle Muted")
+@app_commands.checks.has_permissions(administrator=True)
+async def setmutemode(interaction: discord.Interaction, mode: Literal["timeout", "role"]):
+    guild_id = str(interaction.guild.id)
+    if guild_id not in config:
+        config[guild_id] = {}
+    config[guild_id]["mute_mode"] = mode
+    config_store.mark_dirty(guild_id)
+    await interaction.response.send_message(f"Mode de sourdine configuré : {mode}", ephemeral=True)
 
 @tree.command(name="mute", description="Mettre un membre en sourdine")
 @app_commands.describe(member="Membre à mettre en sourdine", duration="Durée en minutes (optionnel, laisser vide pour mute permanent)")
 @app_commands.checks.has_permissions(administrator=True)
 async def mute(interaction: discord.Interaction, member: discord.Member, duration: int = None):
     guild = interaction.guild
+    mode = config.get(str(guild.id), {}).get("mute_mode", MUTE_MODE)
+    if mode == "timeout" and duration and duration <= MAX_TIMEOUT_MINUTES:
+        try:
+            # Discord lève l'exclusion tout seul à l'échéance
+            await member.timeout(timedelta(minutes=duration), reason=f"Sourdine par {interaction.user}")
+            await interaction.response.send_message(f"{member.mention} est en sourdine pour {duration} minutes.")
+        except Exception as e:
+            await interaction.response.send_message(f"Erreur lors de la mise en sourdine: {e}", ephemeral=True)
+        return
+
     muted_role = discord.utils.get(guild.roles, name="Muted")
+    deferred = False
+    note = ""
     if not muted_role:
+        # Configuration des salons potentiellement longue : on diffère la réponse
+        await interaction.response.defer()
+        deferred = True
         try:
             muted_role = await guild.create_role(name="Muted", permissions=discord.Permissions(send_messages=False, add_reactions=False, speak=False, connect=False))
-            for channel in guild.channels:
-                await channel.set_permissions(muted_role, send_messages=False, add_reactions=False, speak=False, connect=False)
         except Exception as e:
-            await interaction.response.send_message(f"Erreur lors de la création du rôle Muted: {e}", ephemeral=True)
+            await interaction.edit_original_response(content=f"Erreur lors de la création du rôle Muted: {e}")
             return
+
+        async def progress(done, total):
+            try:
+                await interaction.edit_original_response(content=f"Configuration du rôle Muted : {done}/{total} salons…")
+            except Exception:
+                pass
+
+        failed = await apply_muted_overwrites(muted_role, list(guild.channels), progress)
+        if failed:
+            note = f"\n⚠️ Rôle Muted créé, mais {failed} salon(s) n'ont pas pu être configurés."
+
+    async def finish(content, **kwargs):
+        # Réponse différée : le message de progression devient le résultat final
+        if deferred:
+            await interaction.edit_original_response(content=content + note)
+        else:
+            await interaction.response.send_message(content, **kwargs)
+
     try:
         await member.add_roles(muted_role)
         if duration:
-            await interaction.response.send_message(f"{member.mention} est en sourdine pour {duration} minutes.")
-            await asyncio.sleep(duration * 60)
-            await member.remove_roles(muted_role)
-            await interaction.channel.send(f"{member.mention} n'est plus en sourdine.")
+            await sanction_scheduler.add(guild.id, member.id, "mute", time.time() + duration * 60, interaction.channel.id)
+            await finish(f"{member.mention} est en sourdine pour {duration} minutes.")
         else:
-            await interaction.response.send_message(f"{member.mention} est en sourdine permanente.")
+            # Un mute permanent remplace un éventuel mute temporaire en cours
+            await sanction_scheduler.remove(guild.id, member.id, "mute")
+            await finish(f"{member.mention} est en sourdine permanente.")
     except Exception as e:
-        await interaction.response.send_message(f"Erreur lors de la mise en sourdine: {e}", ephemeral=True)
+        await finish(f"Erreur lors de la mise en sourdine: {e}", ephemeral=True)
 
 @tree.command(name="unmute", description="Enlever la sourdine d'un membre")
 @app_commands.describe(member="Membre à enlever de la sourdine")
@@ -219,12 +1237,16 @@ async def mute(interaction: discord.Interaction, member: discord.Member, duratio
 async def unmute(interaction: discord.Interaction, member: discord.Member):
     guild = interaction.guild
     muted_role = discord.utils.get(guild.roles, name="Muted")
-    if not muted_role:
-        await interaction.response.send_message("Le rôle Muted n'existe pas.", ephemeral=True)
-        return
     try:
-        if muted_role in member.roles:
+        was_muted = False
+        if member.is_timed_out():
+            await member.timeout(None, reason=f"Fin de sourdine par {interaction.user}")
+            was_muted = True
+        if muted_role and muted_role in member.roles:
             await member.remove_roles(muted_role)
+            await sanction_scheduler.remove(guild.id, member.id, "mute")
+            was_muted = True
+        if was_muted:
             await interaction.response.send_message(f"{member.mention} n'est plus en sourdine.")
         else:
             await interaction.response.send_message(f"{member.mention} n'était pas en sourdine.", ephemeral=True)
@@ -234,6 +1256,465 @@ async def unmute(interaction: discord.Interaction, member: discord.Member):
 # ----------- /play -----------
 music_queues = {}
 
+# ----------- Résolution yt-dlp -----------
+# extract_info est bloquant (réseau + extracteur) : il tourne dans un pool de
+# workers borné, chacun gardant sa propre instance YoutubeDL. Les requêtes
+# identiques en cours sont regroupées en une seule extraction.
+
+YTDL_OPTIONS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'default_search': 'auto',
+    'noplaylist': True,
+    'socket_timeout': 10,
+}
+YTDL_WORKERS = 4          # extractions simultanées maximum
+YTDL_TIMEOUT = 20         # secondes avant d'abandonner une requête
+YTDL_USE_PROCESSES = False  # True : pool de processus au lieu de threads
+PLAYLIST_MAX_ENTRIES = 100  # musiques ajoutées au maximum depuis une playlist
+
+# Playlists : extraction "à plat" (titres et liens seulement, aucune URL de flux)
+YTDL_PLAYLIST_OPTIONS = dict(
+    YTDL_OPTIONS,
+    noplaylist=False,
+    extract_flat='in_playlist',
+    lazy_playlist=True,
+    playlistend=PLAYLIST_MAX_ENTRIES,
+)
+
+_ytdl_local = threading.local()
+
+def _get_ytdl(flat=False):
+    # Une instance YoutubeDL par worker (et par mode), créée au démarrage du worker puis réutilisée
+    name = "ydl_flat" if flat else "ydl"
+    ydl = getattr(_ytdl_local, name, None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(YTDL_PLAYLIST_OPTIONS if flat else YTDL_OPTIONS)
+        setattr(_ytdl_local, name, ydl)
+    return ydl
+
+def _extract_track(query):
+    info = _get_ytdl().extract_info(query, download=False)
+    if 'entries' in info:
+        info = info['entries'][0]
+    # Seuls les champs utiles sont renvoyés (moins de données à copier entre processus)
+    return {
+        "id": info.get('id'),
+        "url": info['url'],
+        "title": info.get('title', 'Musique inconnue'),
+        "thumbnail": info.get('thumbnail'),
+        "uploader": info.get('uploader'),
+        "webpage_url": info.get('webpage_url'),
+        "duration": info.get('duration'),
+        "acodec": info.get('acodec'),
+    }
+
+# ----------- Cache des musiques -----------
+# Cache LRU en mémoire des métadonnées + URL de flux déjà résolues. La durée de
+# vie d'une entrée suit le paramètre `expire` de l'URL googlevideo, pour ne
+# jamais donner une URL expirée à FFmpeg. Les métadonnées (sans URL de flux)
+# peuvent être gardées sur disque : après un redémarrage, une recherche déjà
+# connue est ré-extraite directement depuis l'URL de la vidéo.
+
+TRACK_CACHE_SIZE = 512
+TRACK_CACHE_TTL = 3 * 3600       # durée max d'une entrée (et durée par défaut sans paramètre expire)
+TRACK_CACHE_MARGIN = 5 * 60      # marge avant l'expiration de l'URL de flux
+# None pour désactiver le cache disque ; un fichier par worker en mode cluster
+TRACK_CACHE_FILE = f"track_cache.{CLUSTER_NAME}.json" if CLUSTER_WORKER else "track_cache.json"
+TRACK_CACHE_DISK_SIZE = 5000
+
+YOUTUBE_ID_RE = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)([\w-]{11})")
+
+def track_cache_key(query):
+    match = YOUTUBE_ID_RE.search(query)
+    if match:
+        return f"yt:{match.group(1)}"
+    return "q:" + " ".join(query.lower().split())
+
+def stream_url_expiry(url):
+    # Timestamp d'expiration d'une URL de flux (paramètre expire=), None si absent
+    params = parse_qs(urlparse(url).query)
+    if "expire" not in params:
+        # Certaines URL googlevideo le placent dans le chemin : /expire/1700000000/
+        match = re.search(r"/expire/(\d+)", url)
+        return int(match.group(1)) if match else None
+    try:
+        return int(params["expire"][0])
+    except ValueError:
+        return None
+
+class TrackCache:
+    def __init__(self, max_size=TRACK_CACHE_SIZE, path=TRACK_CACHE_FILE, disk_size=TRACK_CACHE_DISK_SIZE):
+        self.max_size = max_size
+        self.path = path
+        self.disk_size = disk_size
+        self._entries = OrderedDict()  # clé -> (expire_at, track)
+        self._disk = OrderedDict()     # clé -> métadonnées sans URL de flux
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.extractions = 0
+        self.extraction_time = 0.0
+        if path and os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    self._disk.update(json.load(f))
+            except Exception as e:
+                music_log.warning("Failed to load track cache %s: %s", path, e)
+
+    def get(self, key, valid_until=None):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expire_at, track = entry
+            if expire_at > max(time.time(), valid_until or 0):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return track
+            if expire_at <= time.time():
+                del self._entries[key]
+        self.misses += 1
+        return None
+
+    def known_url(self, key):
+        # URL de la vidéo retenue pour cette recherche lors d'une session précédente
+        meta = self._disk.get(key)
+        if meta and meta.get("webpage_url"):
+            self.disk_hits += 1
+            return meta["webpage_url"]
+        return None
+
+    def put(self, key, track, elapsed=None):
+        if elapsed is not None:
+            self.extractions += 1
+            self.extraction_time += elapsed
+        now = time.time()
+        expire_at = now + TRACK_CACHE_TTL
+        url_expiry = stream_url_expiry(track["url"])
+        if url_expiry is not None:
+            expire_at = min(expire_at, url_expiry - TRACK_CACHE_MARGIN)
+        if expire_at <= now:
+            return
+        keys = [key]
+        if track.get("id") and track.get("webpage_url") and "youtube" in track["webpage_url"]:
+            keys.append(f"yt:{track['id']}")
+        meta = {k: v for k, v in track.items() if k != "url"}
+        for k in keys:
+            self._entries[k] = (expire_at, track)
+            self._entries.move_to_end(k)
+            if self.path:
+                self._disk[k] = meta
+                self._disk.move_to_end(k)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        while len(self._disk) > self.disk_size:
+            self._disk.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        average = self.extraction_time / self.extractions if self.extractions else 0.0
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_extraction": average,
+            "saved_seconds": self.hits * average,
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._disk, f)
+        os.replace(tmp_path, self.path)
+
+def _extract_playlist(query):
+    info = _get_ytdl(flat=True).extract_info(query, download=False)
+    entries = []
+    for entry in itertools.islice(info.get('entries') or [], PLAYLIST_MAX_ENTRIES):
+        if not entry:
+            continue
+        link = entry.get('webpage_url') or entry.get('url')
+        if not link or not link.startswith("http"):
+            if entry.get('ie_key') != 'Youtube' or not entry.get('id'):
+                continue
+            link = f"https://www.youtube.com/watch?v={entry['id']}"
+        # Musique "en attente" : l'URL de flux sera résolue juste avant la lecture
+        entries.append({
+            "id": entry.get('id'),
+            "url": None,
+            "title": entry.get('title') or link,
+            "thumbnail": None,
+            "uploader": entry.get('uploader') or entry.get('channel'),
+            "webpage_url": link,
+            "duration": entry.get('duration'),
+            "query": link,
+        })
+    return {"title": info.get('title', 'Playlist'), "entries": entries}
+
+def is_playlist_query(query):
+    query = query.strip()
+    if not query.startswith(("http://", "https://")):
+        return False
+    parsed = urlparse(query)
+    if "/sets/" in parsed.path:
+        return True
+    # Seules les pages de playlist comptent : un lien watch?v=...&list=... copié
+    # depuis une playlist reste une seule vidéo (noplaylist), et les mix "RD..."
+    # sont des radios sans fin
+    playlist_ids = parse_qs(parsed.query).get("list", [])
+    return parsed.path.rstrip("/").endswith("/playlist") and any(not pid.startswith("RD") for pid in playlist_ids)
+
+class TrackResolver:
+    def __init__(self, workers=YTDL_WORKERS, timeout=YTDL_TIMEOUT, use_processes=YTDL_USE_PROCESSES, cache=None):
+        if use_processes:
+            # "spawn" et non fork : au premier /play le bot a déjà des threads (logs, SQLite, asyncio),
+            # et un fork avec des threads en cours peut bloquer l'enfant sur un verrou hérité
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_get_ytdl,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, initializer=_get_ytdl)
+        self.timeout = timeout
+        self.cache = cache
+        self._pending = {}
+
+    def _done(self, key, future, started):
+        self._pending.pop(key, None)
+        if future.cancelled():
+            return
+        # Récupérer l'exception évite l'avertissement "never retrieved" si tous les appelants ont abandonné
+        if future.exception() is None and self.cache is not None and started is not None:
+            self.cache.put(key, future.result(), time.perf_counter() - started)
+
+    @metrics.timed("ytdl", "resolve")
+    async def resolve(self, query, valid_until=None):
+        # valid_until : l'URL de flux doit rester valide jusqu'à ce timestamp
+        key = track_cache_key(query)
+        if self.cache is not None:
+            track = self.cache.get(key, valid_until)
+            if track is not None:
+                return track
+        future = self._pending.get(key)
+        if future is None:
+            target = query.strip()
+            if self.cache is not None:
+                target = self.cache.known_url(key) or target
+            started = time.perf_counter()
+            future = asyncio.get_running_loop().run_in_executor(self._executor, _extract_track, target)
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._done(key, f, started))
+        # shield : un appelant qui abandonne n'annule pas l'extraction des autres
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    @metrics.timed("ytdl", "resolve_playlist")
+    async def resolve_playlist(self, query):
+        key = "playlist:" + query.strip()
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, _extract_playlist, query.strip())
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._done(key, f, None))
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache is not None:
+            self.cache.save()
+
+track_resolver = TrackResolver(cache=TrackCache())
+
+# ----------- Lecture -----------
+# Les files contiennent des dicts de musique (ceux du resolver + la requête
+# d'origine). Peu avant la fin d'une musique, les suivantes sont re-validées
+# (URL de flux encore valide, sinon nouvelle résolution) et le FFmpeg de la
+# prochaine est lancé à l'avance, pour enchaîner sans blanc.
+
+FFMPEG_OPTIONS = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn',
+}
+PREFETCH_LEAD = 15       # secondes avant la fin pour préparer la musique suivante
+PREFETCH_DEPTH = 2       # nombre de musiques suivantes re-validées
+STREAM_URL_MARGIN = 60   # marge de validité exigée sur une URL de flux
+
+# "opus" : flux Opus (WebM/Ogg) transmis tel quel sans décodage ni ré-encodage,
+# PCM seulement si la source n'est pas en Opus. "pcm" : toujours FFmpegPCMAudio.
+PLAYBACK_MODE = "opus"
+
+QUEUE_DISPLAY_LIMIT = 20  # musiques affichées par /queue
+
+prepared_sources = {}  # guild_id -> (musique, source FFmpeg déjà lancée)
+prefetch_tasks = {}
+
+def ffmpeg_process_count():
+    # Un FFmpeg par salon en lecture (ou en pause) + un par source préparée d'avance
+    playing = sum(1 for vc in bot.voice_clients if vc.is_playing() or vc.is_paused())
+    return playing + len(prepared_sources)
+
+metrics.gauge("bot_ffmpeg_processes", ffmpeg_process_count)
+metrics.gauge("bot_music_queued_tracks", lambda: sum(len(queue) for queue in music_queues.values()))
+metrics.gauge("bot_music_queues", lambda: sum(1 for queue in music_queues.values() if queue))
+
+class TrackAudio(discord.AudioSource):
+    # Compte les trames lues : position de lecture réelle, pauses comprises
+    def __init__(self, source):
+        self.source = source
+        self.frames = 0
+
+    @property
+    def position(self):
+        return self.frames * 0.02
+
+    def read(self):
+        data = self.source.read()
+        if data:
+            self.frames += 1
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+def track_needs_refresh(track, valid_until):
+    if not track.get('url'):
+        return True
+    expiry = stream_url_expiry(track['url'])
+    return expiry is not None and expiry - STREAM_URL_MARGIN < valid_until
+
+async def refresh_track(track, valid_until):
+    if track_needs_refresh(track, valid_until):
+        fresh = await track_resolver.resolve(track.get('webpage_url') or track['query'], valid_until=valid_until + STREAM_URL_MARGIN)
+        track.update(fresh)
+    return track
+
+async def create_source(track):
+    if PLAYBACK_MODE == "opus":
+        codec = track.get('acodec')
+        if not codec or codec == 'none':
+            # Codec inconnu de yt-dlp : on interroge ffprobe (hors de la boucle)
+            try:
+                codec, _ = await discord.FFmpegOpusAudio.probe(track['url'])
+            except Exception as e:
+                music_log.warning("Codec probe failed for %s: %s", track.get("title"), e)
+                codec = None
+        if codec == 'opus':
+            return discord.FFmpegOpusAudio(track['url'], codec='copy', **FFMPEG_OPTIONS)
+    return discord.FFmpegPCMAudio(track['url'], **FFMPEG_OPTIONS)
+
+def discard_prepared(guild_id):
+    prepared = prepared_sources.pop(guild_id, None)
+    if prepared:
+        prepared[1].cleanup()
+
+def reset_music(guild_id):
+    music_queues.pop(guild_id, None)
+    discard_prepared(guild_id)
+    task = prefetch_tasks.pop(guild_id, None)
+    if task:
+        task.cancel()
+
+async def start_next_track(guild_id, voice_client):
+    queue = music_queues.get(guild_id)
+    if not queue:
+        return None
+    if not voice_client.is_connected():
+        reset_music(guild_id)
+        return None
+    if voice_client.is_playing() or voice_client.is_paused():
+        return None
+
+    track = queue.popleft()
+    prepared = prepared_sources.pop(guild_id, None)
+    source = None
+    if prepared and prepared[0] is track:
+        source = prepared[1]
+    elif prepared:
+        prepared[1].cleanup()
+
+    if source is None:
+        try:
+            await refresh_track(track, time.time() + (track.get('duration') or 0))
+        except Exception as e:
+            music_log.warning("Failed to resolve %s: %s", track.get("title") or track["query"], e, extra={"guild": guild_id})
+            return await start_next_track(guild_id, voice_client)
+        try:
+            source = await create_source(track)
+        except Exception as e:
+            # FFmpeg introuvable ou impossible à lancer : musique sautée comme un échec de résolution
+            music_log.warning("Failed to start FFmpeg for %s: %s", track.get("title") or track["query"], e, extra={"guild": guild_id})
+            return await start_next_track(guild_id, voice_client)
+        # File vidée (/stop) ou lecture démarrée par une autre commande pendant l'attente
+        if music_queues.get(guild_id) is not queue or voice_client.is_playing() or voice_client.is_paused():
+            source.cleanup()
+            if music_queues.get(guild_id) is queue:
+                queue.appendleft(track)
+            return None
+
+    audio = TrackAudio(source)
+    try:
+        voice_client.play(audio, after=lambda e: play_next(guild_id, voice_client))
+    except discord.ClientException as e:
+        music_log.error("Failed to start playback: %s", e, extra={"guild": guild_id})
+        audio.cleanup()
+        return None
+
+    task = prefetch_tasks.pop(guild_id, None)
+    if task:
+        task.cancel()
+    task = prefetch_tasks[guild_id] = asyncio.create_task(prefetch_next(guild_id, voice_client, track, audio))
+    task.add_done_callback(lambda t: log_music_failure(t, "Prefetch", guild_id))
+    return track
+
+def log_music_failure(future, what, guild_id):
+    # Tâches que personne n'attend (préchargement, suite de la file) : sans ce callback l'erreur serait perdue
+    if not future.cancelled() and future.exception():
+        music_log.error("%s failed", what, exc_info=future.exception(), extra={"guild": guild_id})
+
+def play_next(guild_id, voice_client):
+    # Appelé depuis le thread audio à la fin d'une musique : la suite se fait dans la boucle
+    future = asyncio.run_coroutine_threadsafe(start_next_track(guild_id, voice_client), bot.loop)
+    future.add_done_callback(lambda f: log_music_failure(f, "Next track", guild_id))
+
+async def prefetch_next(guild_id, voice_client, current, audio):
+    remaining = 0
+    duration = current.get('duration')
+    if duration:
+        while True:
+            if voice_client.source is not audio:
+                return
+            remaining = duration - audio.position
+            if remaining <= PREFETCH_LEAD:
+                break
+            # Si la musique est en pause, la position n'a pas avancé : on attend à nouveau
+            await asyncio.sleep(remaining - PREFETCH_LEAD)
+        remaining = max(0, remaining)
+
+    queue = music_queues.get(guild_id)
+    if not queue:
+        return
+    valid_until = time.time() + remaining
+    for track in list(queue)[:PREFETCH_DEPTH]:
+        valid_until += track.get('duration') or 0
+        try:
+            await refresh_track(track, valid_until)
+        except Exception as e:
+            music_log.warning("Prefetch failed for %s: %s", track.get("title") or track["query"], e, extra={"guild": guild_id})
+
+    # FFmpeg lancé à l'avance uniquement quand la fin est proche (sinon la connexion resterait ouverte longtemps)
+    if not duration or music_queues.get(guild_id) is not queue or not queue:
+        return
+    next_track = queue[0]
+    if next_track.get('url') and guild_id not in prepared_sources and voice_client.source is audio:
+        source = await create_source(next_track)
+        if guild_id in prepared_sources or voice_client.source is not audio:
+            source.cleanup()
+        else:
+            prepared_sources[guild_id] = (next_track, source)
+
 @tree.command(name="play", description="Jouer musique YouTube")
 @app_commands.describe(url="Lien YouTube ou mots clés")
 async def play(interaction: discord.Interaction, url: str):
@@ -246,83 +1727,136 @@ async def play(interaction: discord.Interaction, url: str):
     voice_client = guild.voice_client
 
     try:
-        print(f"Attempting voice connection for guild {guild.id} in channel {voice_state.channel.id}")
         channel = voice_state.channel
         permissions = channel.permissions_for(guild.me)
-        print(f"Voice channel region: {getattr(channel, 'rtc_region', 'automatic')}")
-        print(f"Bot permissions in channel: connect={permissions.connect}, speak={permissions.speak}")
+        if voice_log.isEnabledFor(logging.DEBUG):
+            voice_log.debug("Attempting voice connection", extra={
+                "guild": guild.id, "channel": channel.id, "region": getattr(channel, "rtc_region", None),
+                "connect": permissions.connect, "speak": permissions.speak,
+            })
         if not permissions.connect or not permissions.speak:
             await interaction.response.send_message("Je n'ai pas les permissions nécessaires pour me connecter ou parler dans ce salon vocal.", ephemeral=True)
             return
         if not voice_client:
             voice_client = await channel.connect()
-            print(f"Connected to voice channel {channel.id} in guild {guild.id}")
+            voice_log.info("Connected to voice channel", extra={"guild": guild.id, "channel": channel.id})
         elif voice_client.channel != channel:
             await voice_client.move_to(channel)
-            print(f"Moved voice client to channel {channel.id} in guild {guild.id}")
+            voice_log.info("Moved voice client", extra={"guild": guild.id, "channel": channel.id})
     except Exception as e:
-        print(f"Voice connection error in guild {guild.id}: {e}")
+        voice_log.warning("Voice connection error: %s", e, extra={"guild": guild.id})
         await interaction.response.send_message(f"Erreur de connexion vocale: {e}", ephemeral=True)
         return
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'quiet': True,
-        'default_search': 'auto',
-        'noplaylist': True,
-    }
-
     try:
         await interaction.response.defer()
     except discord.errors.InteractionResponded:
         pass
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            if 'entries' in info:
-                info = info['entries'][0]
-            url2 = info['url']
-            title = info.get('title', 'Musique inconnue')
-            thumbnail = info.get('thumbnail')
-            uploader = info.get('uploader')
-
-        queue = music_queues.setdefault(guild.id, deque())
-        queue.append((url2, title, thumbnail, uploader))
-
-        if not voice_client.is_playing():
-            url2, title, thumbnail, uploader = queue.popleft()
-            source = discord.FFmpegPCMAudio(url2)
-            voice_client.play(source, after=lambda e: play_next(guild.id, voice_client))
-
-            embed = discord.Embed(title=title, description=f"Par {uploader}", color=discord.Color.blue())
-            if thumbnail:
-                embed.set_thumbnail(url=thumbnail)
-            await interaction.followup.send(embed=embed)
+        playlist = None
+        if is_playlist_query(url):
+            playlist = await track_resolver.resolve_playlist(url)
+            if not playlist["entries"]:
+                await interaction.followup.send("Aucune musique trouvée dans cette playlist.")
+                return
+            queue = music_queues.setdefault(guild.id, deque())
+            # Copies : le résultat peut être partagé avec une requête identique d'un autre serveur
+            queue.extend(dict(entry) for entry in playlist["entries"])
         else:
-            await interaction.followup.send(f"🎵 Ajouté à la file d'attente : **{title}**")
+            track = await track_resolver.resolve(url)
+            queue = music_queues.setdefault(guild.id, deque())
+            # Copie : le dict du cache est partagé entre serveurs
+            queue.append(dict(track, query=url))
+
+        started = await start_next_track(guild.id, voice_client)
+        if started:
+            embed = discord.Embed(title=started['title'], description=f"Par {started['uploader']}", color=discord.Color.blue())
+            if started['thumbnail']:
+                embed.set_thumbnail(url=started['thumbnail'])
+            await interaction.followup.send(embed=embed)
+        if playlist:
+            await interaction.followup.send(f"🎵 {len(playlist['entries'])} musiques ajoutées depuis **{playlist['title']}**")
+        elif not started:
+            await interaction.followup.send(f"🎵 Ajouté à la file d'attente : **{track['title']}**")
+    except asyncio.TimeoutError:
+        await interaction.followup.send("Erreur: la recherche de la musique a pris trop de temps, réessaie.")
     except Exception as e:
         await interaction.followup.send(f"Erreur: {e}")
 
+# ----------- Déconnexion automatique -----------
+# Nombre d'auditeurs (hors bots) dans le salon vocal du bot, tenu à jour à
+# partir de chaque événement : pas de parcours des membres du serveur. Quand le
+# salon se vide, le bot part après un court délai s'il reste seul.
+
+VOICE_IDLE_GRACE = 60  # secondes seul dans le salon avant de se déconnecter
+
+voice_listeners = {}    # guild_id -> auditeurs dans le salon du bot
+voice_idle_timers = {}  # guild_id -> tâche de déconnexion en attente
+
+def count_listeners(channel):
+    return sum(1 for m in channel.members if not m.bot)
+
+def update_idle_timer(guild):
+    timer = voice_idle_timers.pop(guild.id, None)
+    if timer:
+        timer.cancel()
+    if guild.id in voice_listeners and voice_listeners[guild.id] == 0:
+        voice_idle_timers[guild.id] = asyncio.create_task(disconnect_when_idle(guild))
+
+async def disconnect_when_idle(guild):
+    await asyncio.sleep(VOICE_IDLE_GRACE)
+    voice_idle_timers.pop(guild.id, None)
+    voice_client = guild.voice_client
+    if not voice_client:
+        return
+    # Compteur possiblement faussé (reconnexion sans diffs) : recomptage du seul salon du bot
+    voice_listeners[guild.id] = count_listeners(voice_client.channel)
+    if voice_listeners[guild.id]:
+        return
+    try:
+        reset_music(guild.id)
+        await voice_client.disconnect()
+        voice_log.info("Disconnected from voice channel due to no members present", extra={"guild": guild.id})
+    except Exception as e:
+        voice_log.warning("Error disconnecting from voice channel: %s", e, extra={"guild": guild.id})
+
+def recount_voice_listeners():
+    # Après une reconnexion non reprise, le cache est reconstruit sans voice_state_update :
+    # les compteurs sont recalculés pour chaque salon où le bot est connecté
+    voice_listeners.clear()
+    for voice_client in bot.voice_clients:
+        guild = voice_client.guild
+        voice_listeners[guild.id] = count_listeners(voice_client.channel)
+        update_idle_timer(guild)
+
 @bot.event
 async def on_voice_state_update(member, before, after):
-    print(f"Voice state update for {member.name}: before={before.channel if before else None}, after={after.channel if after else None}")
+    # Mute, sourdine, stream... : même salon, rien à faire (cas le plus fréquent)
+    if before.channel == after.channel:
+        return
     guild = member.guild
-    voice_client = guild.voice_client
-    if voice_client and voice_client.channel:
-        if not any(m.voice.channel == voice_client.channel for m in guild.members if m.voice):
-            try:
-                await voice_client.disconnect()
-                print(f"Disconnected from voice channel {voice_client.channel} due to no members present.")
-            except Exception as e:
-                print(f"Error disconnecting from voice channel: {e}")
 
-def play_next(guild_id, voice_client):
-    queue = music_queues.get(guild_id)
-    if queue and len(queue) > 0:
-        url2, title, thumbnail, uploader = queue.popleft()
-        source = discord.FFmpegPCMAudio(url2)
-        voice_client.play(source, after=lambda e: play_next(guild_id, voice_client))
+    if member.id == bot.user.id:
+        # Le bot a rejoint, changé de salon ou quitté : recomptage unique du nouveau salon
+        if after.channel:
+            voice_listeners[guild.id] = count_listeners(after.channel)
+        else:
+            voice_listeners.pop(guild.id, None)
+        update_idle_timer(guild)
+        return
+
+    if member.bot or guild.id not in voice_listeners:
+        return
+    voice_client = guild.voice_client
+    bot_channel = voice_client.channel if voice_client else None
+    if bot_channel is None or bot_channel not in (before.channel, after.channel):
+        return
+    if before.channel == bot_channel:
+        voice_listeners[guild.id] = max(0, voice_listeners[guild.id] - 1)
+    if after.channel == bot_channel:
+        voice_listeners[guild.id] += 1
+    update_idle_timer(guild)
 
 # ----------- /leave -----------
 @tree.command(name="pause", description="Mettre la musique en pause")
@@ -347,8 +1881,8 @@ async def resume(interaction: discord.Interaction):
 async def stop(interaction: discord.Interaction):
     voice_client = interaction.guild.voice_client
     if voice_client:
+        reset_music(interaction.guild.id)
         voice_client.stop()
-        music_queues.pop(interaction.guild.id, None)
         await interaction.response.send_message("Musique arrêtée et file d'attente vidée", ephemeral=True)
     else:
         await interaction.response.send_message("Je ne suis pas dans un vocal", ephemeral=True)
@@ -369,18 +1903,40 @@ async def queue_command(interaction: discord.Interaction):
         await interaction.response.send_message("La file d'attente est vide", ephemeral=True)
         return
     description = ""
-    for i, (_, title, _, _) in enumerate(queue, start=1):
-        description += f"{i}. {title}\n"
+    for i, track in enumerate(itertools.islice(queue, QUEUE_DISPLAY_LIMIT), start=1):
+        description += f"{i}. {track['title']}\n"
+    if len(queue) > QUEUE_DISPLAY_LIMIT:
+        description += f"... et {len(queue) - QUEUE_DISPLAY_LIMIT} autre(s)"
     embed = discord.Embed(title="File d'attente", description=description, color=discord.Color.blue())
     await interaction.response.send_message(embed=embed)
 
+@tree.command(name="musiccache", description="Statistiques du cache des musiques")
+@app_commands.checks.has_permissions(administrator=True)
+async def musiccache(interaction: discord.Interaction):
+    stats = track_resolver.cache.stats()
+    embed = discord.Embed(title="Cache des musiques", color=discord.Color.blue())
+    embed.add_field(name="Entrées", value=str(stats["entries"]))
+    embed.add_field(name="Succès / échecs", value=f"{stats['hits']} / {stats['misses']} ({stats['hit_rate']:.0%})")
+    embed.add_field(name="Recherches connues (disque)", value=str(stats["disk_hits"]))
+    embed.add_field(name="Extraction moyenne", value=f"{stats['avg_extraction']:.2f} s")
+    embed.add_field(name="Temps d'extraction économisé", value=f"{stats['saved_seconds']:.0f} s")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # ----------- Ping Minecraft -----------
 
+MC_PING_TIMEOUT = 5        # secondes max par serveur
+MC_PING_CONCURRENCY = 50   # pings simultanés maximum
+MC_STATUS_TTL = 25         # un même serveur n'est interrogé qu'une fois par passage
+MC_MAX_BACKOFF = 600       # intervalle max entre deux pings d'un serveur hors ligne
+MC_DNS_MIN_TTL = 60
+MC_DNS_MAX_TTL = 3600
+MC_DNS_NEGATIVE_TTL = 300  # durée de cache quand il n'y a pas d'enregistrement SRV
+
 async def ping_minecraft(ip, port=25565):
-    server = JavaServer.lookup(f"{ip}:{port}")
-    loop = asyncio.get_event_loop()
+    # ip : hôte déjà résolu (cible SRV éventuelle), pas de nouvelle résolution SRV ici
     try:
-        status = await loop.run_in_executor(None, server.status)
+        server = JavaServer(ip, port, timeout=MC_PING_TIMEOUT)
+        status = await asyncio.wait_for(server.async_status(tries=1), MC_PING_TIMEOUT)
         player_sample = []
         if status.players.sample:
             player_sample = [player.name for player in status.players.sample]
@@ -392,18 +1948,195 @@ async def ping_minecraft(ip, port=25565):
             "motd": status.description if hasattr(status, 'description') else status.motd,
             "player_names": player_sample,
         }
+    except asyncio.TimeoutError:
+        return {"online": False, "error": "timeout"}
     except Exception as e:
         return {"online": False, "error": str(e)}
 
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+async def _lookup_srv(host):
+    # Comme le client Minecraft : _minecraft._tcp.<hôte>, sinon l'hôte lui-même sur 25565
+    try:
+        answer = await dns.asyncresolver.resolve(f"_minecraft._tcp.{host}", "SRV", lifetime=MC_PING_TIMEOUT)
+    except dns.exception.DNSException:
+        return host, 25565, MC_DNS_NEGATIVE_TTL
+    record = answer[0]
+    ttl = min(max(answer.rrset.ttl, MC_DNS_MIN_TTL), MC_DNS_MAX_TTL)
+    return str(record.target).rstrip(".").lower(), record.port, ttl
+
+class MinecraftStatusCache:
+    # Statut partagé par tous les serveurs Discord qui pointent vers le même
+    # serveur Minecraft (clé : hôte:port après résolution SRV). Les serveurs
+    # hors ligne sont interrogés de moins en moins souvent.
+    def __init__(self, ttl=MC_STATUS_TTL, max_backoff=MC_MAX_BACKOFF, concurrency=MC_PING_CONCURRENCY):
+        self.ttl = ttl
+        self.max_backoff = max_backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._srv = {}      # hôte -> (expire_at, hôte cible, port cible)
+        self._entries = {}  # "hôte:port" -> état du dernier ping
+        self.pings = 0
+        self.hits = 0
+
+    async def resolve(self, host, port):
+        host = host.strip().lower().rstrip(".")
+        # Le SRV n'est consulté que pour le port par défaut (adresse saisie sans port)
+        if port != 25565 or _is_ip_address(host):
+            return host, port
+        now = time.monotonic()
+        cached = self._srv.get(host)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+        target, target_port, ttl = await _lookup_srv(host)
+        self._srv[host] = (now + ttl, target, target_port)
+        return target, target_port
+
+    async def get(self, host, port=25565):
+        target, target_port = await self.resolve(host, port)
+        entry = self._entries.setdefault(
+            f"{target}:{target_port}", {"result": None, "next_due": 0.0, "failures": 0, "task": None}
+        )
+        now = time.monotonic()
+        entry["last_used"] = now
+        if entry["task"] is not None:
+            # Ping déjà en cours pour ce serveur (demandé par un autre serveur Discord)
+            return await entry["task"]
+        if entry["result"] is not None and now < entry["next_due"]:
+            self.hits += 1
+            return entry["result"]
+        entry["task"] = asyncio.ensure_future(self._refresh(entry, target, target_port))
+        return await entry["task"]
+
+    async def _refresh(self, entry, host, port):
+        try:
+            async with self._semaphore:
+                self.pings += 1
+                result = await ping_minecraft(host, port)
+        finally:
+            entry["task"] = None
+        if result["online"]:
+            entry["failures"] = 0
+            delay = self.ttl
+        else:
+            entry["failures"] += 1
+            delay = min(self.ttl * 2 ** (entry["failures"] - 1), self.max_backoff)
+        entry["result"] = result
+        entry["next_due"] = time.monotonic() + delay
+        return result
+
+    def prune(self):
+        # Oublie les serveurs qui ne sont plus demandés par aucune config
+        limit = time.monotonic() - 2 * self.max_backoff
+        for key in [key for key, entry in self._entries.items() if entry["last_used"] < limit and entry["task"] is None]:
+            del self._entries[key]
+        now = time.monotonic()
+        for host in [host for host, cached in self._srv.items() if cached[0] <= now]:
+            del self._srv[host]
+
+minecraft_status_cache = MinecraftStatusCache()
+
 # ----------- Update statut -----------
 
-@tasks.loop(seconds=30)
-async def update_status():
-    def strip_minecraft_colors(text):
-        # Remove Minecraft color codes like §a, §b, etc.
-        return re.sub(r'§.', '', text)
+STATUS_INTERVAL = 30
+STATUS_MAX_STALENESS = 600  # secondes : édition forcée même si rien n'a changé
+status_pass_stats = {"duration": 0.0, "guilds": 0, "pings": 0}
+# Empreinte du dernier embed envoyé par serveur : (empreinte, heure de l'envoi)
+status_fingerprints = {}
+status_edit_stats = {"sent": 0, "suppressed": 0}
+
+metrics.gauge("bot_status_pass_duration_seconds", lambda: status_pass_stats["duration"])
+metrics.gauge("bot_status_pass_guilds", lambda: status_pass_stats["guilds"])
+metrics.gauge("bot_status_pass_pings", lambda: status_pass_stats["pings"])
+metrics.gauge("bot_status_embeds_sent", lambda: status_edit_stats["sent"])
+metrics.gauge("bot_status_embeds_unchanged", lambda: status_edit_stats["suppressed"])
+
+def strip_minecraft_colors(text):
+    # Remove Minecraft color codes like §a, §b, etc.
+    return re.sub(r'§.', '', text)
+
+def get_status_message(guild_id, conf, channel):
+    msg = status_messages.get(guild_id)
+    if msg and msg.channel.id != channel.id:
+        # Salon de statut changé via /config
+        msg = None
+    if msg is None and conf.get("status_message_id"):
+        # Après un redémarrage : message partiel à partir de l'ID enregistré, sans requête REST
+        msg = channel.get_partial_message(conf["status_message_id"])
+        status_messages[guild_id] = msg
+    return msg
+
+async def update_guild_status(guild_id, conf, channel):
+    ip = conf.get("ip")
+    port = conf.get("port", 25565)
+    status_info = await minecraft_status_cache.get(ip, port)
+
+    embed = discord.Embed(
+        title="📊 Statut serveur Minecraft",
+        color=discord.Color.green() if status_info["online"] else discord.Color.red()
+    )
+    ip_display = ip if port == 25565 else f"{ip}:{port}"
+    ip_link = f"[{ip_display}](https://{ip})"
+    embed.add_field(name="Adresse", value=ip_link)
+    embed.add_field(name="Statut", value="🟢 En ligne" if status_info["online"] else "🔴 Hors ligne")
+
+    if status_info["online"]:
+        embed.add_field(name="Joueurs connectés", value=f"{status_info['players']} / {status_info['max_players']}")
+        # Hide version as requested
+        # embed.add_field(name="Version", value=status_info['version'])
+        # Add player list if available
+        player_names = status_info.get('player_names', [])
+        if player_names:
+            embed.add_field(name="Joueurs", value=', '.join(player_names), inline=False)
+        motd_clean = strip_minecraft_colors(status_info['motd'])
+        embed.add_field(name="MOTD", value=motd_clean)
+
+    embed.set_footer(text=f"Mis à jour toutes les {STATUS_INTERVAL} secondes")
+
+    fingerprint = hash(json.dumps(embed.to_dict(), sort_keys=True))
+    msg = get_status_message(guild_id, conf, channel)
+    if msg:
+        # Rien de visible n'a changé : pas d'appel REST, sauf si le message est trop ancien
+        previous = status_fingerprints.get(guild_id)
+        if previous and previous[0] == fingerprint and time.monotonic() - previous[1] < STATUS_MAX_STALENESS:
+            status_edit_stats["suppressed"] += 1
+            return
 
-    for guild_id, conf in config.items():
+    if msg:
+        try:
+            await msg.edit(embed=embed)
+        except discord.NotFound:
+            # Le message a été supprimé : on en poste un nouveau
+            msg = None
+        except Exception as e:
+            # Erreur passagère : on réessaiera au prochain passage, sans poster de doublon
+            status_log.warning("Erreur lors de la mise à jour du message : %s", e, extra={"guild": guild_id})
+            return
+    if not msg:
+        try:
+            msg = await channel.send(embed=embed)
+        except Exception as e:
+            status_log.warning("Erreur lors de l'envoi du message : %s", e, extra={"guild": guild_id})
+            return
+        status_messages[guild_id] = msg
+        guild_config = config.get(guild_id)
+        if guild_config is not None:
+            guild_config["status_message_id"] = msg.id
+            config_store.mark_dirty(guild_id)
+    status_fingerprints[guild_id] = (fingerprint, time.monotonic())
+    status_edit_stats["sent"] += 1
+
+@tasks.loop(seconds=STATUS_INTERVAL)
+@metrics.timed("loop", "update_status")
+async def update_status():
+    started = time.perf_counter()
+    jobs = []
+    # Copie : la config peut changer pendant le passage
+    for guild_id, conf in list(config.items()):
         guild = bot.get_guild(int(guild_id))
         if not guild:
             continue
@@ -413,92 +2146,201 @@ async def update_status():
         channel = guild.get_channel(channel_id)
         if not channel:
             continue
+        jobs.append((guild_id, conf, channel))
 
-        ip = conf.get("ip")
-        port = conf.get("port", 25565)
-        status_info = await ping_minecraft(ip, port)
-
-        embed = discord.Embed(
-            title="📊 Statut serveur Minecraft",
-            color=discord.Color.green() if status_info["online"] else discord.Color.red()
-        )
-        ip_display = ip if port == 25565 else f"{ip}:{port}"
-        ip_link = f"[{ip_display}](https://{ip})"
-        embed.add_field(name="Adresse", value=ip_link)
-        embed.add_field(name="Statut", value="🟢 En ligne" if status_info["online"] else "🔴 Hors ligne")
-        
-        if status_info["online"]:
-            embed.add_field(name="Joueurs connectés", value=f"{status_info['players']} / {status_info['max_players']}")
-            # Hide version as requested
-            # embed.add_field(name="Version", value=status_info['version'])
-            # Add player list if available
-            player_names = status_info.get('player_names', [])
-            if player_names:
-                embed.add_field(name="Joueurs", value=', '.join(player_names), inline=False)
-            motd_clean = strip_minecraft_colors(status_info['motd'])
-            embed.add_field(name="MOTD", value=motd_clean)
-
-        embed.set_footer(text="Mis à jour toutes les 30 secondes")
-
-        msg = status_messages.get(guild_id)
-        if not msg:
-            try:
-                msg = await channel.send(embed=embed)
-                status_messages[guild_id] = msg
-            except Exception as e:
-                print(f"Erreur lors de l'envoi du message : {e}")
-        else:
-            try:
-                await msg.edit(embed=embed)
-            except Exception as e:
-                print(f"Erreur lors de la mise à jour du message : {e}")
-                try:
-                    msg = await channel.send(embed=embed)
-                    status_messages[guild_id] = msg
-                except Exception as e:
-                    print(f"Erreur lors de l'envoi du message : {e}")
-
+    # Tous les serveurs sont interrogés en parallèle : un serveur lent ne retarde plus les autres
+    pings = minecraft_status_cache.pings
+    results = await asyncio.gather(
+        *(update_guild_status(guild_id, conf, channel) for guild_id, conf, channel in jobs),
+        return_exceptions=True,
+    )
+    for (guild_id, _, _), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            status_log.error("Status update failed: %s", result, extra={"guild": guild_id})
+
+    minecraft_status_cache.prune()
+
+    duration = time.perf_counter() - started
+    pings = minecraft_status_cache.pings - pings
+    status_pass_stats.update(duration=duration, guilds=len(jobs), pings=pings)
+    status_log.info("Status pass", extra={
+        "guilds": len(jobs), "pings": pings, "duration": round(duration, 3),
+        "sent": status_edit_stats["sent"], "unchanged": status_edit_stats["suppressed"],
+    })
+    if duration > STATUS_INTERVAL:
+        status_log.warning("Status pass took longer than the %ss interval", STATUS_INTERVAL)
+
+@update_status.before_loop
+async def before_update_status():
+    # Démarrée dans setup_hook : attendre que les serveurs soient en cache
+    await bot.wait_until_ready()
 
 import random
 from discord.utils import get
 from datetime import datetime, timedelta
 
 # --- Système de Warns ---
-
-def get_warns(guild_id, user_id):
-    guild_warns = config.get(str(guild_id), {}).get("warns", {})
-    return guild_warns.get(str(user_id), [])
-
-def save_warns(guild_id, user_id, warns):
-    if str(guild_id) not in config:
-        config[str(guild_id)] = {}
-    if "warns" not in config[str(guild_id)]:
-        config[str(guild_id)]["warns"] = {}
-    config[str(guild_id)]["warns"][str(user_id)] = warns
-    save_config(config)
+# Les avertissements sont stockés dans une base SQLite locale (indexée sur
+# serveur, membre, date) et non plus dans config.json. Toutes les requêtes
+# passent par un thread dédié pour ne jamais bloquer la boucle d'événements.
+
+WARNS_DB_FILE = "warns.db"
+WARNS_PER_PAGE = 10
+
+class WarnStore(SQLiteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS warns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            date TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS warns_guild_user_date ON warns (guild_id, user_id, date);
+        CREATE TABLE IF NOT EXISTS migrated_guilds (guild_id INTEGER PRIMARY KEY);
+    """
+
+    def __init__(self, path=WARNS_DB_FILE):
+        super().__init__(path)
+
+    def _add(self, guild_id, user_id, reason, date):
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT INTO warns (guild_id, user_id, reason, date) VALUES (?, ?, ?, ?)",
+                (guild_id, user_id, reason, date),
+            )
+        return self._count(guild_id, user_id)
+
+    def _count(self, guild_id, user_id):
+        row = self._db().execute(
+            "SELECT COUNT(*) FROM warns WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)
+        ).fetchone()
+        return row[0]
+
+    def _page(self, guild_id, user_id, offset, limit):
+        return self._db().execute(
+            "SELECT reason, date FROM warns WHERE guild_id = ? AND user_id = ? ORDER BY date, id LIMIT ? OFFSET ?",
+            (guild_id, user_id, limit, offset),
+        ).fetchall()
+
+    def _clear(self, guild_id, user_id):
+        db = self._db()
+        with db:
+            return db.execute("DELETE FROM warns WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).rowcount
+
+    async def add(self, guild_id, user_id, reason, date):
+        return await self._call(self._add, guild_id, user_id, reason, date)
+
+    async def count(self, guild_id, user_id):
+        return await self._call(self._count, guild_id, user_id)
+
+    async def page(self, guild_id, user_id, offset, limit=WARNS_PER_PAGE):
+        return await self._call(self._page, guild_id, user_id, offset, limit)
+
+    async def clear(self, guild_id, user_id):
+        return await self._call(self._clear, guild_id, user_id)
+
+    def _migrate(self, data):
+        db = self._db()
+        done = {row[0] for row in db.execute("SELECT guild_id FROM migrated_guilds")}
+        migrated = []
+        with db:
+            for guild_id, conf in data.items():
+                if "warns" not in conf:
+                    continue
+                # Un serveur déjà importé n'est pas ré-importé (ex: arrêt avant l'écriture de config.json)
+                if int(guild_id) not in done:
+                    db.executemany(
+                        "INSERT INTO warns (guild_id, user_id, reason, date) VALUES (?, ?, ?, ?)",
+                        [
+                            (int(guild_id), int(user_id), entry.get("reason", "Raison non spécifiée"), entry.get("date", ""))
+                            for user_id, entries in conf["warns"].items()
+                            for entry in entries
+                        ],
+                    )
+                    db.execute("INSERT INTO migrated_guilds (guild_id) VALUES (?)", (int(guild_id),))
+                migrated.append(guild_id)
+        return migrated
+
+    def migrate_from_config(self, store):
+        # Migration unique des anciens warns de config.json vers SQLite
+        migrated = self._executor.submit(self._migrate, store.data).result()
+        for guild_id in migrated:
+            store.data[guild_id].pop("warns", None)
+        if migrated:
+            store.mark_dirty(*migrated)
+            warns_log.info("Migrated warns of %s guild(s) from %s to %s", len(migrated), store.path, self.path)
+        return migrated
+
+warn_store = WarnStore()
+
+class WarnsView(discord.ui.View):
+    def __init__(self, author_id, member, total):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.member = member
+        self.total = total
+        self.page = 0
+        self._update_buttons()
+
+    @property
+    def pages(self):
+        return max(1, (self.total + WARNS_PER_PAGE - 1) // WARNS_PER_PAGE)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    async def build_embed(self):
+        offset = self.page * WARNS_PER_PAGE
+        rows = await warn_store.page(self.member.guild.id, self.member.id, offset)
+        embed = discord.Embed(title=f"Avertissements de {self.member}", color=discord.Color.orange())
+        for i, (reason, date_str) in enumerate(rows, start=offset + 1):
+            # Raison tronquée pour rester sous la limite de taille d'un embed
+            embed.add_field(name=f"Avertissement #{i}", value=f"Raison: {reason[:200]}\nDate: {date_str or 'Date inconnue'}", inline=False)
+        embed.set_footer(text=f"Page {self.page + 1}/{self.pages} · {self.total} avertissement(s)")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Seul l'auteur de la commande peut changer de page.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(embed=await self.build_embed(), view=self)
+
+    @discord.ui.button(label="◀ Précédent", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="Suivant ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        await self._show(interaction)
 
 @tree.command(name="warn", description="Avertir un membre")
 @app_commands.describe(member="Membre à avertir", reason="Raison de l'avertissement")
 @app_commands.checks.has_permissions(administrator=True)
 async def warn(interaction: discord.Interaction, member: discord.Member, reason: str):
-    warns = get_warns(interaction.guild.id, member.id)
-    warn_entry = {"reason": reason, "date": datetime.utcnow().isoformat()}
-    warns.append(warn_entry)
-    save_warns(interaction.guild.id, member.id, warns)
+    warn_count = await warn_store.add(interaction.guild.id, member.id, reason, datetime.utcnow().isoformat())
 
     embed = discord.Embed(title="⚠️ Avertissement", color=discord.Color.orange())
     embed.add_field(name="Membre", value=member.mention, inline=True)
     embed.add_field(name="Raison", value=reason, inline=True)
-    embed.add_field(name="Nombre total d'avertissements", value=str(len(warns)), inline=False)
+    embed.add_field(name="Nombre total d'avertissements", value=str(warn_count), inline=False)
     embed.set_footer(text=f"Averti par {interaction.user}", icon_url=interaction.user.display_avatar.url)
     await interaction.response.send_message(embed=embed)
 
     # Alerte si beaucoup de warns (ex: 3 ou plus)
-    if len(warns) >= 3:
+    if warn_count >= 3:
         alert_channel = interaction.channel
         alert_embed = discord.Embed(
             title="⚠️ Alerte Warns",
-            description=f"{member.mention} commence à accumuler beaucoup d'avertissements ({len(warns)}). Il faudrait envisager une sanction.",
+            description=f"{member.mention} commence à accumuler beaucoup d'avertissements ({warn_count}). Il faudrait envisager une sanction.",
             color=discord.Color.red()
         )
         await alert_channel.send(embed=alert_embed)
@@ -507,28 +2349,190 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
 @app_commands.describe(member="Membre à consulter")
 @app_commands.checks.has_permissions(administrator=True)
 async def warns(interaction: discord.Interaction, member: discord.Member):
-    warns = get_warns(interaction.guild.id, member.id)
-    if not warns:
+    total = await warn_store.count(interaction.guild.id, member.id)
+    if not total:
         await interaction.response.send_message(f"{member.mention} n'a aucun avertissement.", ephemeral=True)
         return
 
-    embed = discord.Embed(title=f"Avertissements de {member}", color=discord.Color.orange())
-    for i, warn in enumerate(warns, start=1):
-        date_str = warn.get("date", "Date inconnue")
-        reason = warn.get("reason", "Raison non spécifiée")
-        embed.add_field(name=f"Avertissement #{i}", value=f"Raison: {reason}\nDate: {date_str}", inline=False)
-    await interaction.response.send_message(embed=embed)
+    view = WarnsView(interaction.user.id, member, total)
+    embed = await view.build_embed()
+    if view.pages > 1:
+        await interaction.response.send_message(embed=embed, view=view)
+    else:
+        await interaction.response.send_message(embed=embed)
 
 @tree.command(name="clearwarns", description="Supprimer les avertissements d'un membre")
 @app_commands.describe(member="Membre à nettoyer")
 @app_commands.checks.has_permissions(administrator=True)
 async def clearwarns(interaction: discord.Interaction, member: discord.Member):
-    save_warns(interaction.guild.id, member.id, [])
+    await warn_store.clear(interaction.guild.id, member.id)
     await interaction.response.send_message(f"Les avertissements de {member.mention} ont été supprimés.", ephemeral=True)
 
 # --- Système de Giveaways ---
+# Les giveaways sont enregistrés (IDs seulement) dans une base SQLite et
+# rechargés au démarrage. Un planificateur unique dort jusqu'à la prochaine
+# fin (tas trié par date de fin) au lieu de tout parcourir toutes les 30 s.
+
+GIVEAWAYS_DB_FILE = "giveaways.db"
+GIVEAWAY_RETRY_DELAY = 60  # secondes avant le premier réessai d'une fin en erreur (puis doublé)
+ENTRANTS_FLUSH_DELAY = 2   # secondes de regroupement des écritures de participants
+GIVEAWAY_RECONCILE_CONCURRENCY = 4  # relectures de réactions simultanées (après un redémarrage)
+
+class GiveawayStore(SQLiteStore):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS giveaways (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            prize TEXT NOT NULL,
+            end_time REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS giveaway_entrants (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (message_id, user_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path=GIVEAWAYS_DB_FILE):
+        super().__init__(path)
+        self._pending = {}  # (message_id, user_id) -> True (participe) / False (retiré)
+        self._flush_task = None
+
+    def _add(self, message_id, giveaway):
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO giveaways (message_id, guild_id, channel_id, prize, end_time) VALUES (?, ?, ?, ?, ?)",
+                (message_id, giveaway["guild_id"], giveaway["channel_id"], giveaway["prize"], giveaway["end_time"]),
+            )
+
+    def _remove(self, message_id):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM giveaways WHERE message_id = ?", (message_id,))
+            db.execute("DELETE FROM giveaway_entrants WHERE message_id = ?", (message_id,))
+
+    def _load(self):
+        db = self._db()
+        rows = db.execute("SELECT message_id, guild_id, channel_id, prize, end_time FROM giveaways").fetchall()
+        giveaways = {
+            message_id: {"guild_id": guild_id, "channel_id": channel_id, "prize": prize, "end_time": end_time}
+            for message_id, guild_id, channel_id, prize, end_time in rows
+        }
+        entrants = {message_id: set() for message_id in giveaways}
+        for message_id, user_id in db.execute("SELECT message_id, user_id FROM giveaway_entrants"):
+            if message_id in entrants:
+                entrants[message_id].add(user_id)
+        return giveaways, entrants
+
+    def _apply_entrants(self, ops):
+        db = self._db()
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO giveaway_entrants (message_id, user_id) VALUES (?, ?)",
+                [key for key, entered in ops.items() if entered],
+            )
+            db.executemany(
+                "DELETE FROM giveaway_entrants WHERE message_id = ? AND user_id = ?",
+                [key for key, entered in ops.items() if not entered],
+            )
+
+    def _replace_entrants(self, message_id, user_ids):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM giveaway_entrants WHERE message_id = ?", (message_id,))
+            db.executemany(
+                "INSERT INTO giveaway_entrants (message_id, user_id) VALUES (?, ?)",
+                [(message_id, user_id) for user_id in user_ids],
+            )
+
+    def track_entrant(self, message_id, user_id, entered):
+        # Écritures regroupées : une réaction ne coûte qu'une entrée en mémoire
+        self._pending[(message_id, user_id)] = entered
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_entrants())
+
+    async def _flush_entrants(self):
+        while self._pending:
+            await asyncio.sleep(ENTRANTS_FLUSH_DELAY)
+            ops, self._pending = self._pending, {}
+            try:
+                await self._call(self._apply_entrants, ops)
+            except Exception as e:
+                giveaway_log.error("Failed to save giveaway entrants: %s", e)
+
+    async def replace_entrants(self, message_id, user_ids):
+        for key in [key for key in self._pending if key[0] == message_id]:
+            del self._pending[key]
+        await self._call(self._replace_entrants, message_id, list(user_ids))
+
+    def close(self):
+        if self._pending:
+            self._executor.submit(self._apply_entrants, self._pending).result()
+            self._pending = {}
+        super().close()
+
+    async def add(self, message_id, giveaway):
+        await self._call(self._add, message_id, giveaway)
+
+    async def remove(self, message_id):
+        await self._call(self._remove, message_id)
+
+    async def load(self):
+        return await self._call(self._load)
+
+giveaway_store = GiveawayStore()
+active_giveaways = {}  # message_id -> {"guild_id", "channel_id", "prize", "end_time" (timestamp UTC)}
+# Participants suivis au fil des réactions : le tirage ne fait aucun appel REST
+giveaway_entrants = {}  # message_id -> set des IDs des participants
+
+class GiveawayScheduler(DeadlineScheduler):
+    def __init__(self):
+        super().__init__()
+        # Giveaways rechargés : réactions à relire une fois, juste avant le tirage
+        self._needs_reconcile = set()
+        self._reconcile_slots = None
 
-active_giveaways = {}
+    async def start(self):
+        if self.started:
+            return
+        self._reconcile_slots = asyncio.Semaphore(GIVEAWAY_RECONCILE_CONCURRENCY)
+        # Rechargement : les giveaways déjà terminés pendant l'arrêt sont tirés immédiatement
+        giveaways, entrants = await giveaway_store.load()
+        for message_id, giveaway in giveaways.items():
+            if not owns_guild(giveaway["guild_id"]):
+                continue
+            active_giveaways[message_id] = giveaway
+            giveaway_entrants[message_id] = entrants[message_id]
+            # Des réactions ont pu changer pendant l'arrêt. La relecture est faite au
+            # moment du tirage (et non toutes au démarrage) : seuls les giveaways
+            # déjà terminés sont relus tout de suite, quelques-uns à la fois.
+            self._needs_reconcile.add(message_id)
+            self.schedule(message_id, giveaway["end_time"])
+        await super().start()
+
+    async def fire(self, message_id):
+        giveaway = active_giveaways.get(message_id)
+        if giveaway is None:
+            return
+        if message_id in self._needs_reconcile:
+            async with self._reconcile_slots:
+                await reconcile_entrants(message_id, giveaway)
+            self._needs_reconcile.discard(message_id)
+        try:
+            await end_giveaway(message_id, giveaway)
+        except Exception as e:
+            if self.retry(message_id, e, GIVEAWAY_RETRY_DELAY):
+                giveaway_log.warning("Erreur lors de la fin du giveaway, nouvel essai : %s", e, extra={"giveaway": message_id})
+                return
+            giveaway_log.error("Giveaway abandonné : %s", e, extra={"giveaway": message_id})
+        self.cancel(message_id)
+        active_giveaways.pop(message_id, None)
+        giveaway_entrants.pop(message_id, None)
+        await giveaway_store.remove(message_id)
+
+giveaway_scheduler = GiveawayScheduler()
 
 @tree.command(name="giveaway", description="Démarrer un giveaway")
 @app_commands.describe(duration="Durée en minutes", prize="Prix du giveaway")
@@ -549,55 +2553,159 @@ async def giveaway(interaction: discord.Interaction, duration: int, prize: str):
     message = await interaction.channel.send(embed=embed)
     await message.add_reaction("🎉")
 
-    active_giveaways[message.id] = {
+    giveaway = {
+        "guild_id": interaction.guild.id,
         "channel_id": interaction.channel.id,
         "prize": prize,
-        "end_time": datetime.utcnow() + timedelta(minutes=duration),
-        "message": message,
-        "guild_id": interaction.guild.id
+        "end_time": time.time() + duration * 60,
     }
+    active_giveaways[message.id] = giveaway
+    giveaway_entrants[message.id] = set()
+    await giveaway_store.add(message.id, giveaway)
+    giveaway_scheduler.schedule(message.id, giveaway["end_time"])
 
     await interaction.response.send_message(f"Giveaway lancé pour {duration} minute(s) avec le prix : {prize}", ephemeral=True)
 
-async def check_giveaways():
-    to_remove = []
-    for message_id, giveaway in active_giveaways.items():
-        if datetime.utcnow() >= giveaway["end_time"]:
-            channel = bot.get_channel(giveaway["channel_id"])
-            if channel:
-                try:
-                    message = await channel.fetch_message(message_id)
-                    users = set()
-                    for reaction in message.reactions:
-                        if str(reaction.emoji) == "🎉":
-                            async for user in reaction.users():
-                                if not user.bot:
-                                    users.add(user)
-                    if users:
-                        winner = random.choice(list(users))
-                        embed = discord.Embed(
-                            title="🎉 Giveaway terminé !",
-                            description=f"Félicitations {winner.mention} ! Vous avez gagné : **{giveaway['prize']}**",
-                            color=discord.Color.gold(),
-                            timestamp=datetime.utcnow()
-                        )
-                        await channel.send(embed=embed)
-                    else:
-                        await channel.send("Personne n'a participé au giveaway.")
-                    to_remove.append(message_id)
-                except Exception as e:
-                    print(f"Erreur lors de la fin du giveaway: {e}")
-    for message_id in to_remove:
-        active_giveaways.pop(message_id, None)
+async def reconcile_entrants(message_id, giveaway):
+    # Relecture complète des réactions, seulement pour un giveaway rechargé après un arrêt
+    channel = bot.get_channel(giveaway["channel_id"])
+    if not channel:
+        return
+    try:
+        message = await channel.fetch_message(message_id)
+        users = set()
+        for reaction in message.reactions:
+            if str(reaction.emoji) == "🎉":
+                async for user in reaction.users(limit=None):
+                    if not user.bot:
+                        users.add(user.id)
+    except Exception as e:
+        giveaway_log.warning("Failed to reconcile giveaway entrants: %s", e, extra={"giveaway": message_id})
+        return
+    if message_id in active_giveaways:
+        giveaway_entrants[message_id] = users
+        await giveaway_store.replace_entrants(message_id, users)
+
+def giveaway_reaction(payload):
+    return payload.message_id in active_giveaways and str(payload.emoji) == "🎉" and payload.user_id != bot.user.id
+
+@bot.event
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    if not giveaway_reaction(payload):
+        return
+    if payload.member and payload.member.bot:
+        return
+    giveaway_entrants.setdefault(payload.message_id, set()).add(payload.user_id)
+    giveaway_store.track_entrant(payload.message_id, payload.user_id, True)
 
-@tasks.loop(seconds=30)
-async def giveaway_loop():
-    await check_giveaways()
+@bot.event
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    if not giveaway_reaction(payload):
+        return
+    giveaway_entrants.get(payload.message_id, set()).discard(payload.user_id)
+    giveaway_store.track_entrant(payload.message_id, payload.user_id, False)
+
+@bot.event
+async def on_raw_reaction_clear(payload: discord.RawReactionClearEvent):
+    if payload.message_id in active_giveaways:
+        giveaway_entrants[payload.message_id] = set()
+        await giveaway_store.replace_entrants(payload.message_id, ())
+
+@bot.event
+async def on_raw_reaction_clear_emoji(payload: discord.RawReactionClearEmojiEvent):
+    if payload.message_id in active_giveaways and str(payload.emoji) == "🎉":
+        giveaway_entrants[payload.message_id] = set()
+        await giveaway_store.replace_entrants(payload.message_id, ())
+
+async def end_giveaway(message_id, giveaway):
+    channel = bot.get_channel(giveaway["channel_id"])
+    if not channel:
+        # Salon supprimé : le giveaway est abandonné
+        return
+    users = giveaway_entrants.get(message_id)
+    if users:
+        winner_id = random.choice(tuple(users))
+        embed = discord.Embed(
+            title="🎉 Giveaway terminé !",
+            description=f"Félicitations <@{winner_id}> ! Vous avez gagné : **{giveaway['prize']}**",
+            color=discord.Color.gold(),
+            timestamp=datetime.utcnow()
+        )
+        await channel.send(embed=embed)
+    else:
+        await channel.send("Personne n'a participé au giveaway.")
 
 from discord.ui import View, Button
 from discord import Interaction, Embed, PermissionOverwrite
 
 # --- Système de tickets ---
+# Registre des tickets ouverts, enregistré dans la config de chaque serveur
+# ("tickets": {salon: propriétaire}) et indexé en mémoire dans les deux sens :
+# aucune recherche parmi les salons du serveur, et renommer un salon ne casse rien.
+
+TICKET_MAX_PER_USER = 1  # tickets ouverts par membre, par défaut
+
+class TicketRegistry:
+    def __init__(self, store):
+        self.store = store
+        self._owners = {}   # channel_id -> (guild_id, user_id)
+        self._by_user = {}  # (guild_id, user_id) -> set des channel_id
+        for guild_id, conf in store.data.items():
+            for channel_id, user_id in conf.get("tickets", {}).items():
+                self._index(int(guild_id), int(channel_id), user_id)
+
+    def _index(self, guild_id, channel_id, user_id):
+        self._owners[channel_id] = (guild_id, user_id)
+        self._by_user.setdefault((guild_id, user_id), set()).add(channel_id)
+
+    def owner(self, channel_id):
+        entry = self._owners.get(channel_id)
+        return entry[1] if entry else None
+
+    def open_tickets(self, guild_id, user_id):
+        return self._by_user.get((guild_id, user_id), set())
+
+    def live_tickets(self, guild, user_id):
+        # Salons supprimés pendant un arrêt du bot : retirés à la lecture (seuls
+        # les tickets de ce membre sont vérifiés)
+        for channel_id in [c for c in self.open_tickets(guild.id, user_id) if guild.get_channel(c) is None]:
+            self.remove(channel_id)
+        return self.open_tickets(guild.id, user_id)
+
+    def prune(self, client):
+        # Au démarrage : tickets dont le salon ou le serveur n'existe plus
+        for channel_id, (guild_id, _) in list(self._owners.items()):
+            guild = client.get_guild(guild_id)
+            if guild is not None and guild.unavailable:
+                # Panne Discord : le cache du serveur est vide, rien à conclure
+                continue
+            if guild is None or guild.get_channel(channel_id) is None:
+                self.remove(channel_id)
+
+    def add(self, guild_id, channel_id, user_id):
+        self._index(guild_id, channel_id, user_id)
+        self.store.data.setdefault(str(guild_id), {}).setdefault("tickets", {})[str(channel_id)] = user_id
+        self.store.mark_dirty(guild_id)
+
+    def remove(self, channel_id):
+        entry = self._owners.pop(channel_id, None)
+        if entry is None:
+            return
+        guild_id, user_id = entry
+        channels = self._by_user.get((guild_id, user_id))
+        if channels is not None:
+            channels.discard(channel_id)
+            if not channels:
+                del self._by_user[(guild_id, user_id)]
+        self.store.data.get(str(guild_id), {}).get("tickets", {}).pop(str(channel_id), None)
+        self.store.mark_dirty(guild_id)
+
+ticket_registry = TicketRegistry(config_store)
+tickets_opening = set()  # (guild_id, user_id) dont le ticket est en cours de création
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    ticket_registry.remove(channel.id)
 
 class TicketView(View):
     def __init__(self):
@@ -610,14 +2718,15 @@ class CloseTicketView(View):
         self.add_item(Button(label="Fermer le ticket", style=discord.ButtonStyle.red, custom_id="close_ticket"))
 
 @tree.command(name="setticketpanel", description="Configurer le salon du panel d'ouverture de tickets")
-@app_commands.describe(channel="Salon où poster le panel de tickets")
+@app_commands.describe(channel="Salon où poster le panel de tickets", max_tickets="Nombre de tickets ouverts en même temps par membre (défaut 1)")
 @app_commands.checks.has_permissions(administrator=True)
-async def setticketpanel(interaction: discord.Interaction, channel: discord.TextChannel):
+async def setticketpanel(interaction: discord.Interaction, channel: discord.TextChannel, max_tickets: app_commands.Range[int, 1, 10] = TICKET_MAX_PER_USER):
     guild_id = str(interaction.guild.id)
     if guild_id not in config:
         config[guild_id] = {}
     config[guild_id]["ticket_panel_channel_id"] = channel.id
-    save_config(config)
+    config[guild_id]["ticket_max_per_user"] = max_tickets
+    config_store.mark_dirty(guild_id)
     await interaction.response.send_message(f"Salon du panel de tickets configuré : {channel.mention}", ephemeral=True)
 
     # Poster le panel dans le salon configuré
@@ -648,14 +2757,15 @@ async def on_interaction(interaction: Interaction):
             await interaction.response.send_message("Le système de tickets n'est pas configuré. Contactez un administrateur.", ephemeral=True)
             return
 
-        # Vérifier si l'utilisateur a déjà un ticket ouvert
-        existing_ticket = None
-        for channel in interaction.guild.channels:
-            if channel.name == f"ticket-{interaction.user.id}":
-                existing_ticket = channel
-                break
-        if existing_ticket:
-            await interaction.response.send_message(f"Vous avez déjà un ticket ouvert : {existing_ticket.mention}", ephemeral=True)
+        # Vérifier si l'utilisateur a déjà trop de tickets ouverts
+        open_tickets = ticket_registry.live_tickets(interaction.guild, interaction.user.id)
+        if len(open_tickets) >= guild_config.get("ticket_max_per_user", TICKET_MAX_PER_USER):
+            mentions = ", ".join(f"<#{channel_id}>" for channel_id in open_tickets)
+            await interaction.response.send_message(f"Vous avez déjà un ticket ouvert : {mentions}", ephemeral=True)
+            return
+        opening_key = (interaction.guild.id, interaction.user.id)
+        if opening_key in tickets_opening:
+            await interaction.response.send_message("Votre ticket est en cours de création.", ephemeral=True)
             return
 
         # Créer un salon privé pour le ticket
@@ -671,11 +2781,17 @@ async def on_interaction(interaction: Interaction):
                 category = panel_channel.category
 
         channel_name = f"ticket-{interaction.user.id}"
+        if open_tickets:
+            channel_name += f"-{len(open_tickets) + 1}"
+        tickets_opening.add(opening_key)
         try:
             ticket_channel = await interaction.guild.create_text_channel(channel_name, overwrites=overwrites, category=category, reason="Ouverture d'un ticket")
         except Exception as e:
             await interaction.response.send_message(f"Erreur lors de la création du ticket : {e}", ephemeral=True)
             return
+        finally:
+            tickets_opening.discard(opening_key)
+        ticket_registry.add(interaction.guild.id, ticket_channel.id, interaction.user.id)
 
         # Envoyer un message dans le salon ticket avec un bouton pour fermer
         embed = Embed(
@@ -690,21 +2806,73 @@ async def on_interaction(interaction: Interaction):
 
     elif custom_id == "close_ticket":
         # Vérifier que le salon est un ticket
-        if not interaction.channel.name.startswith("ticket-"):
-            await interaction.response.send_message("Ce bouton ne peut être utilisé que dans un salon de ticket.", ephemeral=True)
-            return
+        ticket_owner_id = ticket_registry.owner(interaction.channel.id)
+        if ticket_owner_id is None:
+            # Ticket ouvert avant le registre : propriétaire lu dans le nom du salon
+            legacy = re.fullmatch(r"ticket-(\d+)", interaction.channel.name)
+            if not legacy:
+                await interaction.response.send_message("Ce bouton ne peut être utilisé que dans un salon de ticket.", ephemeral=True)
+                return
+            ticket_owner_id = int(legacy.group(1))
 
         # Vérifier que l'utilisateur est le créateur du ticket ou un administrateur
-        ticket_owner_id = int(interaction.channel.name.split("-")[1])
         if interaction.user.id != ticket_owner_id and not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("Vous n'avez pas la permission de fermer ce ticket.", ephemeral=True)
             return
 
         try:
             await interaction.channel.delete(reason=f"Ticket fermé par {interaction.user}")
+            ticket_registry.remove(interaction.channel.id)
         except Exception as e:
             await interaction.response.send_message(f"Erreur lors de la fermeture du ticket : {e}", ephemeral=True)
             
+# ----------- Transfert des pièces jointes -----------
+# Le fichier joint à /embed est copié depuis le CDN par morceaux : en mémoire
+# s'il est petit, dans un fichier temporaire sinon. Les octets en transit sont
+# plafonnés globalement pour que plusieurs gros envois simultanés ne fassent
+# pas exploser la mémoire. Image et vignette gardent simplement l'URL du CDN.
+
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+ATTACHMENT_SPOOL_THRESHOLD = 1024 * 1024       # au-delà, copie sur disque
+ATTACHMENT_BYTE_BUDGET = 64 * 1024 * 1024      # octets en transit simultanément
+
+class ByteBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, size):
+        # Un fichier plus gros que le budget entier passe seul
+        size = min(size, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_use + size <= self.limit)
+            self.in_use += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= size
+                self._condition.notify_all()
+
+attachment_budget = ByteBudget(ATTACHMENT_BYTE_BUDGET)
+
+async def spool_attachment(attachment):
+    # Copie par morceaux, sans jamais charger tout le fichier en mémoire
+    spool = io.BytesIO() if attachment.size <= ATTACHMENT_SPOOL_THRESHOLD else tempfile.TemporaryFile()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(attachment.url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except BaseException:
+        spool.close()
+        raise
+
 @tree.command(name="embed", description="Envoie un embed personnalisé complet avec uploads")
 @app_commands.describe(
     ping="Utilisateur à mentionner (optionnel)",
@@ -759,17 +2927,83 @@ async def embed(
         embed.add_field(name=champ_nom, value=champ_valeur, inline=False)
 
     if fichier:
-        fichier_bytes = await fichier.read()
-        discord_file = discord.File(fp=io.BytesIO(fichier_bytes), filename=fichier.filename)
-        await interaction.response.send_message(
-            content=mention,
-            embed=embed,
-            file=discord_file
-        )
+        # Le téléchargement peut attendre le budget : réponse différée
+        await interaction.response.defer()
+        async with attachment_budget.reserve(fichier.size):
+            spool = await spool_attachment(fichier)
+            try:
+                await interaction.followup.send(
+                    content=mention,
+                    embed=embed,
+                    file=discord.File(fp=spool, filename=fichier.filename)
+                )
+            finally:
+                spool.close()
     else:
         await interaction.response.send_message(
             content=mention,
             embed=embed
         )
 
-bot.run("token")
+def shard_ranges(shard_count, processes):
+    # Tranches contiguës de shards, les premières prenant le reste de la division
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        if size:
+            ranges.append(range(start, start + size))
+        start += size
+    return ranges
+
+def launch_cluster(processes, shard_count):
+    # Un processus par tranche : chaque worker a sa propre boucle et son propre GIL
+    workers = []
+    try:
+        previous = None
+        for shards in shard_ranges(shard_count, processes):
+            if previous:
+                # Les IDENTIFY sont limités globalement : on laisse le worker précédent connecter ses shards
+                time.sleep(CLUSTER_IDENTIFY_DELAY * len(previous))
+            previous = shards
+            env = dict(
+                os.environ,
+                SHARD_COUNT=str(shard_count),
+                SHARD_IDS=f"{shards.start}-{shards.stop - 1}",
+                CLUSTER_PROCESSES="1",
+            )
+            workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+            cluster_log.info("Started worker %s for shards %s-%s/%s", workers[-1].pid, shards.start, shards.stop - 1, shard_count)
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+if __name__ == "__main__" and CLUSTER_PROCESSES > 1 and SHARD_IDS is None:
+    setup_logging()
+    try:
+        launch_cluster(CLUSTER_PROCESSES, SHARD_COUNT or CLUSTER_PROCESSES)
+    finally:
+        log_listener.stop()
+elif __name__ == "__main__":
+    setup_logging()
+    try:
+        warn_store.migrate_from_config(config_store)
+        # Les logs de discord.py passent aussi par la file (pas de handler par défaut)
+        bot.run("token", log_handler=None)
+    finally:
+        # Dernière écriture des modifications en attente, même si le bot s'arrête sur une erreur
+        # Chaque étape est indépendante : un échec n'empêche pas les suivantes
+        for shutdown in (config_store.flush_sync, warn_store.close, giveaway_store.close, sanction_store.close, track_resolver.close):
+            try:
+                shutdown()
+            except Exception:
+                log.exception("Shutdown step %s failed", shutdown.__qualname__)
+        # En dernier : les erreurs ci-dessus passent encore par la file
+        log_listener.stop()
@@ -0,0 +1,138 @@
+# Passerelle Discord simulée : débit d'événements traités selon le nombre de
+# processus du cluster (même découpage des shards que launch_cluster).
+#
+# Chaque worker importe b.py avec SHARD_COUNT/SHARD_IDS, reçoit les trames de
+# ses shards (JSON compressé zlib, comme la passerelle) et les passe aux vrais
+# handlers de réactions de giveaway (on_raw_reaction_add/remove, écritures
+# SQLite regroupées comprises). Le gain n'apparaît qu'avec plusieurs cœurs.
+#
+#   python3 bench/bench_cluster.py [--shards 8] [--guilds 2000] [--events 200000] [--processes 1,2,4]
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GIVEAWAYS_PER_GUILD = 2
+
+
+def guild_ids(count):
+    # Identifiants répartis sur tous les shards (le shard dépend des bits >> 22)
+    return [(i << 22) | 1 for i in range(count)]
+
+
+def build_frames(guilds, events, seed):
+    # Trames de la passerelle pour les serveurs de ce worker : ajouts et retraits de 🎉
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(events):
+        guild_id = rng.choice(guilds)
+        data = {
+            "guild_id": str(guild_id),
+            "channel_id": str(guild_id + 1),
+            "message_id": str(guild_id + 2 + rng.randrange(GIVEAWAYS_PER_GUILD)),
+            "user_id": str(rng.randrange(10 ** 17, 10 ** 18)),
+            "emoji": {"id": None, "name": "🎉"},
+            "type": 0,
+        }
+        event = "MESSAGE_REACTION_ADD" if rng.random() < 0.8 else "MESSAGE_REACTION_REMOVE"
+        frames.append(zlib.compress(json.dumps({"op": 0, "t": event, "d": data}).encode()))
+    return frames
+
+
+async def consume(b, discord, frames):
+    handlers = {
+        "MESSAGE_REACTION_ADD": ("REACTION_ADD", b.on_raw_reaction_add),
+        "MESSAGE_REACTION_REMOVE": ("REACTION_REMOVE", b.on_raw_reaction_remove),
+    }
+    for i, frame in enumerate(frames):
+        message = json.loads(zlib.decompress(frame))
+        data = message["d"]
+        if not b.owns_guild(data["guild_id"]):
+            raise AssertionError("événement reçu pour un serveur d'un autre worker")
+        event_type, handler = handlers[message["t"]]
+        payload = discord.RawReactionActionEvent(data, discord.PartialEmoji.from_dict(data["emoji"]), event_type)
+        await handler(payload)
+        if i % 1000 == 0:
+            # Laisse tourner les tâches de fond (écriture groupée des participants)
+            await asyncio.sleep(0)
+
+
+def worker(shard_count, shards, total_guilds, events, workdir, barrier, results):
+    os.environ.update(SHARD_COUNT=str(shard_count), SHARD_IDS=f"{shards.start}-{shards.stop - 1}")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import discord
+    import b
+
+    b.bot._connection.user = SimpleNamespace(id=1)
+    owned = [guild_id for guild_id in guild_ids(total_guilds) if b.owns_guild(guild_id)]
+    for guild_id in owned:
+        for n in range(GIVEAWAYS_PER_GUILD):
+            b.active_giveaways[guild_id + 2 + n] = {
+                "guild_id": guild_id, "channel_id": guild_id + 1, "prize": "bench", "end_time": time.time() + 3600,
+            }
+    # Même charge totale quel que soit le découpage : part proportionnelle aux serveurs
+    frames = build_frames(owned, events * len(owned) // total_guilds, seed=shards.start)
+
+    barrier.wait()
+    started = time.perf_counter()
+    asyncio.run(consume(b, discord, frames))
+    b.giveaway_store.close()
+    results.put((len(frames), started, time.perf_counter()))
+
+
+def run(processes, shard_count, guilds, events):
+    workdir = tempfile.mkdtemp(prefix="bench_cluster_")
+    ctx = multiprocessing.get_context("spawn")
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    from b import shard_ranges
+
+    ranges = shard_ranges(shard_count, processes)
+    barrier = ctx.Barrier(len(ranges))
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(shard_count, shards, guilds, events, workdir, barrier, results))
+        for shards in ranges
+    ]
+    for proc in procs:
+        proc.start()
+    stats = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    shutil.rmtree(workdir, ignore_errors=True)
+    handled = sum(count for count, _, _ in stats)
+    elapsed = max(end for _, _, end in stats) - min(start for _, start, _ in stats)
+    return handled, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--guilds", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--processes", default="1,2,4")
+    args = parser.parse_args()
+
+    print(f"{args.shards} shards, {args.guilds} guilds, {args.events} events, {os.cpu_count()} CPU(s)")
+    print(f"{'processes':>10} {'events':>9} {'seconds':>8} {'events/s':>10} {'speedup':>8}")
+    baseline = None
+    for processes in (int(p) for p in args.processes.split(",")):
+        handled, elapsed = run(processes, args.shards, args.guilds, args.events)
+        rate = handled / elapsed
+        baseline = baseline or rate
+        print(f"{processes:>10} {handled:>9} {elapsed:>8.2f} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Mesure le blocage de la boucle d'événements pendant la sauvegarde de la config
+# (ancien save_config synchrone vs ConfigStore à écriture différée).
+#
+#   python3 bench/bench_config_store.py [--guilds 200] [--ops 20]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench_config_"))
+
+import b  # noqa: E402
+
+
+def legacy_save_config(path, config):
+    # Copie de l'ancien save_config (sérialisation complète + fsync dans la boucle)
+    with open(path, "w") as f:
+        json.dump(config, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def build_config(guilds, warn_count):
+    config = {}
+    for i in range(guilds):
+        config[str(1000 + i)] = {"ip": "play.example.net", "port": 25565, "channel_id": 42, "warns": {}}
+    for i in range(warn_count):
+        warns = config[str(1000 + i % guilds)]["warns"].setdefault(str(i % 997), [])
+        warns.append({"reason": f"spam #{i}", "date": datetime(2024, 1, 1).isoformat()})
+    return config
+
+
+async def monitor_lag(stop, samples, interval=0.001):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run_case(save, ops, gap):
+    stop = asyncio.Event()
+    samples = []
+    monitor = asyncio.create_task(monitor_lag(stop, samples))
+    await asyncio.sleep(0.01)
+    for i in range(ops):
+        save(i)
+        await asyncio.sleep(gap)
+    stop.set()
+    await monitor
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    return max(samples, default=0.0), p99
+
+
+async def bench(warn_count, guilds, ops):
+    path = os.path.abspath(f"config_{warn_count}.json")
+    config = build_config(guilds, warn_count)
+    legacy_save_config(path, config)
+
+    def legacy(i):
+        guild_id = str(1000 + i % guilds)
+        config[guild_id]["warns"].setdefault("1", []).append({"reason": "bench", "date": "2024-01-01T00:00:00"})
+        legacy_save_config(path, config)
+
+    legacy_max, legacy_p99 = await run_case(legacy, ops, 0.02)
+
+    store = b.ConfigStore(path, flush_delay=0.05)
+
+    def store_save(i):
+        guild_id = str(1000 + i % guilds)
+        store.data[guild_id]["warns"].setdefault("1", []).append({"reason": "bench", "date": "2024-01-01T00:00:00"})
+        store.mark_dirty(guild_id)
+
+    store_max, store_p99 = await run_case(store_save, ops, 0.02)
+    await store.flush()
+    with open(path) as f:
+        assert json.load(f) == store.data
+    return legacy_max, legacy_p99, store_max, store_p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'warns':>8} | {'save_config max':>16} {'p99':>9} | {'ConfigStore max':>16} {'p99':>9}")
+    for warn_count in (1_000, 10_000, 100_000):
+        legacy_max, legacy_p99, store_max, store_p99 = asyncio.run(bench(warn_count, args.guilds, args.ops))
+        print(
+            f"{warn_count:>8} | {legacy_max * 1000:>13.2f} ms {legacy_p99 * 1000:>6.2f} ms"
+            f" | {store_max * 1000:>13.2f} ms {store_p99 * 1000:>6.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    main()
+    print(f"total {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,109 @@
+# Compare le coût CPU par flux vocal des deux modes de lecture sur des fichiers
+# audio locaux : PCM (FFmpeg décode, puis encodage Opus côté Python à chaque
+# trame de 20 ms, comme AudioPlayer) et passthrough Opus (FFmpeg copie le flux).
+#
+#   python3 bench/bench_opus_passthrough.py [--streams 1,4,16] [--seconds 30] [--file audio.webm]
+#
+# Nécessite ffmpeg dans le PATH. Sans libopus, le coût d'encodage du mode PCM
+# ne peut pas être mesuré et seul le décodage FFmpeg est compté.
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench_opus_"))
+
+import discord  # noqa: E402
+import b  # noqa: E402
+
+# Les options -reconnect ne concernent que les flux HTTP
+b.FFMPEG_OPTIONS = {'options': '-vn'}
+
+
+def make_test_file(seconds):
+    path = os.path.abspath("sine.webm")
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi",
+         "-i", f"sine=frequency=440:duration={seconds}", "-ac", "2", "-c:a", "libopus", "-b:a", "128k", path],
+        check=True,
+    )
+    return path
+
+
+def load_encoder():
+    try:
+        if not discord.opus.is_loaded():
+            discord.opus._load_default()
+        if discord.opus.is_loaded():
+            return True
+    except Exception:
+        pass
+    return False
+
+
+def consume(source, frames, encode):
+    # Même travail que AudioPlayer pour une trame, sans l'attente de 20 ms
+    encoder = discord.opus.Encoder() if encode else None
+    for _ in range(frames):
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None:
+            encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+    source.cleanup()
+
+
+def run(mode, path, streams, seconds, encode):
+    b.PLAYBACK_MODE = mode
+    track = {"url": path, "title": "sine", "acodec": "opus"}
+    sources = [asyncio.run(b.create_source(track)) for _ in range(streams)]
+    frames = int(seconds / 0.02)
+
+    cpu_self = time.process_time()
+    cpu_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    threads = [threading.Thread(target=consume, args=(source, frames, encode and not source.is_opus())) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    python_cpu = time.process_time() - cpu_self
+    ffmpeg_cpu = (children.ru_utime - cpu_children.ru_utime) + (children.ru_stime - cpu_children.ru_stime)
+    audio_seconds = streams * seconds
+    return python_cpu / audio_seconds, ffmpeg_cpu / audio_seconds, wall, type(sources[0]).__name__
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", default="1,4,16")
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--file", help="fichier audio Opus/WebM local (généré sinon)")
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.file) if args.file else make_test_file(args.seconds)
+    encode = load_encoder()
+    if not encode:
+        print("libopus introuvable : encodage Python du mode PCM non mesuré")
+
+    print("CPU en ms par seconde d'audio et par flux")
+    print(f"{'mode':>5} {'flux':>5} | {'source':>16} {'python':>8} {'ffmpeg':>8} {'total':>8} | {'durée':>7}")
+    for streams in (int(n) for n in args.streams.split(",")):
+        for mode in ("pcm", "opus"):
+            python_cpu, ffmpeg_cpu, wall, source_type = run(mode, path, streams, args.seconds, encode)
+            print(
+                f"{mode:>5} {streams:>5} | {source_type:>16} {python_cpu * 1000:>8.2f} {ffmpeg_cpu * 1000:>8.2f}"
+                f" {(python_cpu + ffmpeg_cpu) * 1000:>8.2f} | {wall:>6.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+# Banc d'essai hors ligne des chemins chauds de b.py, sans Discord ni réseau :
+# serveurs, salons et membres factices, serveur de statut Minecraft local et
+# extracteur yt-dlp simulé. Ce sont les vrais handlers de b.py qui sont appelés.
+#
+#   python3 bench/bench_suite.py [--guilds 1000] [--members 100] [--only update_status,voice]
+#                                [--json resultats.json] [--compare ancien.json]
+#
+# --json enregistre les résultats, --compare les met en regard d'un passage
+# précédent (par exemple sur un autre commit).
+
+import argparse
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="bench_suite_"))
+
+import discord  # noqa: E402
+import b  # noqa: E402
+
+MC_SERVERS = 50            # serveurs Minecraft distincts partagés par les serveurs Discord
+YTDL_STUB_LATENCY = 0.02   # durée simulée d'une extraction yt-dlp
+BOT_ID = 1
+
+
+# ----------- Faux objets Discord -----------
+
+class FakeMessage:
+    _ids = iter(range(10 ** 15, 10 ** 16))
+
+    def __init__(self, channel, message_id=None):
+        self.channel = channel
+        self.id = message_id or next(self._ids)
+
+    async def edit(self, **kwargs):
+        self.channel.edits += 1
+
+
+class FakeChannel:
+    def __init__(self, channel_id, members=()):
+        self.id = channel_id
+        self.members = list(members)
+        self.sends = 0
+        self.edits = 0
+
+    async def send(self, **kwargs):
+        self.sends += 1
+        return FakeMessage(self)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+
+class FakeGuild:
+    def __init__(self, guild_id, member_count):
+        self.id = guild_id
+        self.status_channel = FakeChannel(guild_id + 1)
+        self.voice_channels = [FakeChannel(guild_id + 2 + n) for n in range(3)]
+        self.members = [
+            SimpleNamespace(id=guild_id * 1000 + n, bot=False, guild=self)
+            for n in range(member_count)
+        ]
+        self.me = SimpleNamespace(id=BOT_ID, bot=True, guild=self)
+        self.voice_client = SimpleNamespace(channel=self.voice_channels[0])
+        self._channels = {c.id: c for c in [self.status_channel, *self.voice_channels]}
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+
+def build_guilds(count, members):
+    guilds = {}
+    for i in range(count):
+        guild = FakeGuild(10 ** 6 * (i + 1), members)
+        guilds[guild.id] = guild
+    b.bot.get_guild = guilds.get
+    b.bot._connection.user = SimpleNamespace(id=BOT_ID)
+    return guilds
+
+
+# ----------- Serveur Minecraft factice -----------
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+async def _read_varint(reader):
+    value = shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+        shift += 7
+
+
+async def _mc_client(reader, writer, status):
+    try:
+        while True:
+            length = await _read_varint(reader)
+            packet = await reader.readexactly(length)
+            if packet[0] == 0 and length == 1:
+                # Status request : réponse JSON
+                body = json.dumps(status).encode()
+                data = b"\x00" + _varint(len(body)) + body
+                writer.write(_varint(len(data)) + data)
+            elif packet[0] == 1:
+                # Ping : renvoi du même jeton
+                writer.write(_varint(len(packet)) + packet)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_minecraft_servers(count):
+    servers, ports = [], []
+    for i in range(count):
+        status = {
+            "version": {"name": "1.20.4", "protocol": 765},
+            "players": {"online": i % 20, "max": 100, "sample": [{"name": f"joueur{n}", "id": "0" * 32} for n in range(i % 5)]},
+            "description": f"§aServeur de test §b#{i}",
+        }
+        server = await asyncio.start_server(lambda r, w, s=status: _mc_client(r, w, s), "127.0.0.1", 0)
+        servers.append(server)
+        ports.append(server.sockets[0].getsockname()[1])
+    return servers, ports
+
+
+# ----------- Extracteur yt-dlp simulé -----------
+
+class StubYoutubeDL:
+    def __init__(self, options=None):
+        self.options = options
+
+    def extract_info(self, query, download=False):
+        time.sleep(YTDL_STUB_LATENCY)
+        video_id = f"{abs(hash(query)) % 10 ** 11:011d}"
+        return {
+            "id": video_id,
+            "url": f"https://rr1.googlevideo.com/videoplayback?expire={int(time.time()) + 6 * 3600}&id={video_id}",
+            "title": f"Musique {query}",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "duration": 180,
+            "acodec": "opus",
+        }
+
+
+# ----------- Mesures -----------
+
+def summarize(case, latencies, elapsed, **extra):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else 0.0
+    return {
+        "case": case,
+        "ops": len(latencies),
+        "seconds": round(elapsed, 4),
+        "ops_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(pick(0.50), 4),
+        "p99_ms": round(pick(0.99), 4),
+        "max_ms": round(pick(1.0), 4),
+        **extra,
+    }
+
+
+async def timed_calls(calls):
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - started
+
+
+# ----------- Cas -----------
+
+async def bench_update_status(guilds, args):
+    servers, ports = await start_minecraft_servers(MC_SERVERS)
+    for i, guild in enumerate(guilds.values()):
+        b.config[str(guild.id)] = {"ip": "127.0.0.1", "port": ports[i % len(ports)], "channel_id": guild.status_channel.id}
+    results = []
+    # Passage à froid (pings réels vers le serveur local), puis à chaud (cache + empreintes)
+    for label in ("cold", "warm"):
+        pings = b.minecraft_status_cache.pings
+        started = time.perf_counter()
+        await b.update_status()
+        elapsed = time.perf_counter() - started
+        results.append(summarize(
+            f"update_status[{label}]", [elapsed], elapsed,
+            guilds=len(guilds), pings=b.minecraft_status_cache.pings - pings,
+            sends=sum(g.status_channel.sends for g in guilds.values()),
+            edits=sum(g.status_channel.edits for g in guilds.values()),
+        ))
+    for server in servers:
+        server.close()
+    return results
+
+
+async def bench_voice(guilds, args):
+    rng = random.Random(1)
+    # Le bot rejoint son salon dans chaque serveur : recomptage complet des membres
+    calls = []
+    for guild in guilds.values():
+        guild.voice_channels[0].members = list(guild.members)
+        calls.append(lambda g=guild: b.on_voice_state_update(
+            g.me, SimpleNamespace(channel=None), SimpleNamespace(channel=g.voice_channels[0])))
+    join_latencies, join_elapsed = await timed_calls(calls)
+
+    # Tempête d'événements : déplacements, mute/sourdine (même salon), départs
+    calls = []
+    for _ in range(args.events):
+        guild = rng.choice(list(guilds.values()))
+        member = rng.choice(guild.members)
+        before, after = rng.sample(guild.voice_channels + [None], 2) if rng.random() < 0.5 else (guild.voice_channels[0],) * 2
+        calls.append(lambda m=member, x=before, y=after: b.on_voice_state_update(
+            m, SimpleNamespace(channel=x), SimpleNamespace(channel=y)))
+    storm_latencies, storm_elapsed = await timed_calls(calls)
+    for timer in b.voice_idle_timers.values():
+        timer.cancel()
+    return [
+        summarize("voice[bot_join]", join_latencies, join_elapsed, members=args.members),
+        summarize("voice[storm]", storm_latencies, storm_elapsed, members=len(guilds) * args.members),
+    ]
+
+
+async def bench_config_save(guilds, args):
+    store = b.ConfigStore(os.path.abspath("bench_config.json"), flush_delay=3600)
+    for guild in guilds.values():
+        store.data[str(guild.id)] = {"ip": "play.example.net", "port": 25565, "channel_id": 42, "autorole_id": 7}
+    store.mark_dirty(*store.data)
+    started = time.perf_counter()
+    await store.flush()
+    full = time.perf_counter() - started
+
+    # Modifications ponctuelles : seuls les serveurs modifiés sont re-sérialisés
+    rng = random.Random(2)
+    ids = list(store.data)
+    calls = []
+    for _ in range(args.config_ops):
+        guild_id = rng.choice(ids)
+
+        async def change(guild_id=guild_id):
+            store.data[guild_id]["port"] += 1
+            store.mark_dirty(guild_id)
+            await store.flush()
+        calls.append(change)
+    latencies, elapsed = await timed_calls(calls)
+    store._flush_task and store._flush_task.cancel()
+    return [
+        summarize("config_save[full]", [full], full, guilds=len(ids)),
+        summarize("config_save[one_guild]", latencies, elapsed, guilds=len(ids)),
+    ]
+
+
+async def bench_tickets(guilds, args):
+    rng = random.Random(3)
+    # Un ticket ouvert par membre : la recherche se fait dans un registre de guilds × members tickets
+    channel_id = 10 ** 12
+    tickets = []
+    for guild in guilds.values():
+        b.config.setdefault(str(guild.id), {})["ticket_panel_channel_id"] = guild.status_channel.id
+        for member in guild.members:
+            channel_id += 1
+            # Le salon doit exister : les tickets dont le salon a disparu sont purgés à la lecture
+            guild._channels[channel_id] = FakeChannel(channel_id)
+            b.ticket_registry._index(guild.id, channel_id, member.id)
+            tickets.append((guild, channel_id, member))
+
+    replies = []
+
+    def interaction(custom_id, guild, user_id, channel_id):
+        async def send_message(content, **kwargs):
+            replies.append(content)
+        return SimpleNamespace(
+            type=discord.InteractionType.component,
+            data={"custom_id": custom_id},
+            guild=guild,
+            user=SimpleNamespace(id=user_id, guild_permissions=SimpleNamespace(administrator=False)),
+            channel=SimpleNamespace(id=channel_id),
+            response=SimpleNamespace(send_message=send_message),
+        )
+
+    calls = []
+    for _ in range(args.events):
+        guild, channel_id, member = rng.choice(tickets)
+        if rng.random() < 0.5:
+            # Ouverture refusée : le membre a déjà un ticket
+            calls.append(lambda i=interaction("open_ticket", guild, member.id, guild.status_channel.id): b.on_interaction(i))
+        else:
+            # Fermeture refusée : quelqu'un d'autre que le créateur
+            calls.append(lambda i=interaction("close_ticket", guild, member.id + 1, channel_id): b.on_interaction(i))
+    latencies, elapsed = await timed_calls(calls)
+    assert not any("Erreur" in reply for reply in replies), replies[:3]
+    return [summarize("ticket_lookup", latencies, elapsed, tickets=len(tickets))]
+
+
+async def bench_play_resolve(guilds, args):
+    b.yt_dlp.YoutubeDL = StubYoutubeDL
+    resolver = b.TrackResolver(cache=b.TrackCache(path=None))
+    rng = random.Random(4)
+    # Recherches concurrentes avec beaucoup de doublons (morceaux populaires)
+    queries = [f"morceau {int(rng.paretovariate(1.2)) % 200}" for _ in range(args.resolves)]
+    latencies = []
+
+    async def one(query):
+        t = time.perf_counter()
+        await resolver.resolve(query)
+        latencies.append(time.perf_counter() - t)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - started
+    stats = resolver.cache.stats()
+    resolver.close()
+    return [summarize("play_resolve", latencies, elapsed, unique=len(set(queries)), cache=stats)]
+
+
+CASES = {
+    "update_status": bench_update_status,
+    "voice": bench_voice,
+    "config_save": bench_config_save,
+    "tickets": bench_tickets,
+    "play_resolve": bench_play_resolve,
+}
+
+
+async def run(args):
+    guilds = build_guilds(args.guilds, args.members)
+    results = []
+    for name in args.only.split(",") if args.only else CASES:
+        results += await CASES[name](guilds, args)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--members", type=int, default=100, help="membres par serveur")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--config-ops", type=int, default=200)
+    parser.add_argument("--resolves", type=int, default=2000)
+    parser.add_argument("--only", help=f"cas à lancer parmi {','.join(CASES)}")
+    parser.add_argument("--json", help="fichier où enregistrer les résultats")
+    parser.add_argument("--compare", help="résultats JSON d'un passage précédent")
+    args = parser.parse_args()
+
+    # Journaux des handlers (setup_logging() n'est pas appelé) : retenus en mémoire pendant les
+    # mesures au lieu de passer par le handler de secours de logging sur stderr
+    bot_log = logging.getLogger("bot")
+    captured = logging.handlers.BufferingHandler(capacity=10 ** 9)
+    bot_log.addHandler(captured)
+    bot_log.propagate = False
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        bot_log.removeHandler(captured)
+        bot_log.propagate = True
+    warnings = [r for r in captured.buffer if r.levelno >= logging.WARNING]
+    if warnings:
+        print(f"{len(warnings)} avertissement(s) des handlers, dernier : {warnings[-1].getMessage()}")
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {r["case"]: r for r in json.load(f)["results"]}
+
+    print(f"{args.guilds} guilds x {args.members} members")
+    print(f"{'case':<24} {'ops':>8} {'seconds':>9} {'ops/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}  vs")
+    for r in results:
+        before = previous.get(r["case"])
+        delta = f"{r['p99_ms'] / before['p99_ms']:.2f}x p99" if before and before["p99_ms"] else ""
+        print(
+            f"{r['case']:<24} {r['ops']:>8} {r['seconds']:>9.3f} {r['ops_per_s']:>11.1f}"
+            f" {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['max_ms']:>9.3f}  {delta}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()